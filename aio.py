@@ -0,0 +1,120 @@
+"""
+asyncio API for converting from inside an event loop, e.g. a web service.
+
+aconvert yields a collection's rows without blocking the loop: files are read on
+the loop's default thread pool and parsed and mapped on an executor, several files
+at a time. At most depth files are in flight ahead of the consumer, so a slow
+consumer holds back the reading and mapping rather than letting rows pile up.
+Collections converted at the same time can share one executor.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from errors import guarded
+from logic import collection_files, detect_profile, find_profile, map_doc, map_file, profiles
+from reader import PREFETCH_DEPTH, open_input
+
+
+def profile_name(filename, engine='soup'):
+    """
+    Identifies the collection profile from its first file, for executors (the parsed document isn't returned
+    so nothing has to be sent back from a worker process)
+    :param filename: the MODS XML file name
+    :param engine: the extraction engine name, see logic.engines
+    :return: the profile name, see logic.profiles
+    """
+    return detect_profile(filename, engine)[0]
+
+
+def first_profile(files, engine='soup'):
+    """
+    Identifies the collection profile from the first file that parses, see profile_name and logic.find_profile
+    :param files: the sorted MODS XML file names
+    :param engine: the extraction engine name, see logic.engines
+    :return: the profile name
+    """
+    return find_profile(files, engine)[0]
+
+
+async def aconvert(input_folder, engine='soup', executor=None, depth=PREFETCH_DEPTH, files=None, report=None):
+    """
+    Converts a folder of XML files, as an async generator of rows:
+        async for row in aconvert(input_folder): ...
+    Rows come out in the sorted file order with the same keys and values as convert_to_csv
+    :param input_folder: the input folder containing XML files
+    :param engine: the extraction engine name, see logic.engines
+    :param executor: the executor to parse and map files on, None for the loop's default thread pool.
+    A ProcessPoolExecutor maps files in parallel, its workers read the files themselves
+    :param depth: the most files read and mapped ahead of the row being consumed
+    :param files: the sorted MODS XML files of the folder from get_mods_files, None to find them, see collection_files
+    :param report: the errors.ErrorReport to record failed files in and carry on, None to stop at the first error.
+    The keys of the rows are numbered without the failed files
+    :return: async generator of row dicts
+    """
+    loop = asyncio.get_running_loop()
+    files = await loop.run_in_executor(None, collection_files, input_folder, files)
+
+    # Memory mapped contents can't be sent to worker processes, nor can parsed documents be sent back
+    in_process = not isinstance(executor, ProcessPoolExecutor)
+    first_doc, first_index = None, 0
+    if in_process:
+        # The document the profile comes from is mapped without parsing the file again
+        if report is not None:
+            profile, first_index, first_doc = await loop.run_in_executor(executor, find_profile, files, engine)
+        else:
+            profile, first_doc = await loop.run_in_executor(executor, detect_profile, files[0], engine)
+    elif report is not None:
+        profile = await loop.run_in_executor(executor, first_profile, files, engine)
+    else:
+        profile = await loop.run_in_executor(executor, profile_name, files[0], engine)
+    cols = profiles[profile]
+    func = partial(guarded, map_file) if report is not None else map_file
+    doc_func = partial(guarded, map_doc) if report is not None else map_doc
+
+    async def map_async(i):
+        nonlocal first_doc
+        if i == first_index and first_doc is not None:
+            doc, first_doc = first_doc, None  # Not kept for the rest of the conversion
+            return await loop.run_in_executor(executor, doc_func, files[i], doc, cols, engine)
+        contents = None
+        if in_process:
+            try:
+                contents = await loop.run_in_executor(None, open_input, files[i])
+            except OSError:
+                pass  # Read again where the file is mapped, so the error comes up there
+        return await loop.run_in_executor(executor, func, files[i], i, cols, engine, contents)
+
+    def results():
+        # The tasks are started depth at a time, the next one once a result is taken
+        queue = deque(asyncio.ensure_future(map_async(i)) for i in range(min(depth, len(files))))
+        started = len(queue)
+        try:
+            while queue:
+                yield queue.popleft()
+                if started < len(files):
+                    queue.append(asyncio.ensure_future(map_async(started)))
+                    started += 1
+        finally:
+            for task in queue:
+                if not task.cancel() and not task.cancelled():
+                    task.exception()  # Finished already, retrieved so a failure isn't logged
+
+    tasks = results()
+    count = 0
+    try:
+        for task in tasks:
+            result = await task
+            if report is not None:
+                result, failed = result
+                if failed is not None:
+                    # Writing the report and copying to the quarantine folder would block the loop
+                    await loop.run_in_executor(None, report.add, failed)
+                    continue
+                if 'key' in cols:
+                    result['key'] = str(count + 1)
+            count += 1
+            yield result
+    finally:
+        tasks.close()
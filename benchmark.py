@@ -0,0 +1,367 @@
+"""
+Benchmarks for convert_to_csv on synthetic MODS collections.
+
+Generate a corpus, then run it through any mix of engines, modes and worker counts:
+    python benchmark.py generate bench/photographs --records 10000 --kind photographs
+    python benchmark.py run bench/photographs --engine soup lxml --mode buffered streaming --workers 1 4
+    python benchmark.py compare
+
+Each run is measured in a fresh process so peak RSS is per run. Results are appended to
+a JSON lines file (bench_results.jsonl by default) so they can be compared over time.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+import logic
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Collection kinds modelled on the test/input fixtures: file prefix, repo name and typeOfResource
+kinds = {
+    'photographs': ('klhs', 'Kootenay Lake Historical Society', 'still image'),
+    'oralHistories': ('arms', 'Armstrong Spallumcheen Museum and Arts Society', 'sound'),
+    'news': ('doh', 'Kelowna Clarion & Okanagan Advocate', 'text'),
+}
+
+modes = ['buffered', 'streaming', 'split']
+
+GIVEN = ['Doug', 'Ray', 'Jack', 'Robert', 'Grace', 'Bill', 'David', 'Frank', 'Thelma', 'Mary', 'Ronnie', 'Ada']
+FAMILY = ['Jerome', 'Norberg', 'Morris', 'Coldicott', 'Zabriskie', 'Murray', 'Lynch', 'Silva', 'Reagan', 'Hume']
+TOPICS = ['Steamboats', 'Portraits', 'Boats', 'Sports', 'Badminton', 'Emigration & immigration', 'Agriculture',
+          'Railroads', 'Orchards', 'Families', 'Schools', 'Mining']
+PLACES = ['Kootenay Region (B.C.)', 'Armstrong (B.C.)', 'Kelowna (B.C.)', 'Osoyoos (B.C.)', 'Nelson (B.C.)']
+LANGUAGES = ['English', 'French', 'Spanish', 'German', 'Japanese', 'Chinese']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+MODS_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+              '<mods xmlns="http://www.loc.gov/mods/v3" xmlns:mods="http://www.loc.gov/mods/v3" ' \
+              'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+
+
+def random_date(rng):
+    """
+    A dateIssued value, including the badly formatted ones convert_date fixes
+    :param rng: the random.Random
+    :return: the date str
+    """
+    year = rng.randint(1890, 1999)
+    return rng.choice([
+        '%d' % year,
+        '%d-%02d-%02d' % (year, rng.randint(1, 12), rng.randint(1, 28)),
+        '%02d-%02d-%d' % (rng.randint(1, 28), rng.randint(1, 12), year),
+        '%s-%02d' % (rng.choice(MONTHS), year % 100),
+    ])
+
+
+def element(tag, text, **attrs):
+    attributes = ''.join(' %s=%s' % (name, quoteattr(value)) for name, value in attrs.items())
+    return '<%s%s>%s</%s>' % (tag, attributes, escape(text), tag)
+
+
+def person(rng, role=None):
+    role_xml = '<role>%s</role>' % element('roleTerm', role, type='text', authority='marcrelator') if role else ''
+    return '<name type="personal">%s%s%s</name>' % (
+        element('namePart', rng.choice(FAMILY), type='family'),
+        element('namePart', rng.choice(GIVEN), type='given'),
+        role_xml
+    )
+
+
+def generate_record(kind, num, rng, max_names=3, max_subjects=5, max_languages=2):
+    """
+    Generates one synthetic MODS record
+    :param kind: the collection kind, see kinds
+    :param num: the record number
+    :param rng: the random.Random
+    :param max_names: the maximum number of creators, contributors and name subjects
+    :param max_subjects: the maximum number of topics
+    :param max_languages: the maximum number of languages
+    :return: the MODS XML str
+    """
+    repo, holder, resource_type = kinds[kind]
+    date = random_date(rng)
+    parts = [MODS_HEADER]
+
+    if kind == 'news':
+        parts.append('<titleInfo>%s</titleInfo>' % element('title', '%s, issue %d' % (holder, num)))
+        parts.append('<originInfo>%s</originInfo>' % element('dateIssued', date, encoding='w3cdtf', keyDate='yes'))
+        parts.append('<part><detail type="volume">%s</detail><detail type="issue">%s</detail></part>' % (
+            element('number', str(num // 52 + 1)), element('number', str(num % 52 + 1))))
+        parts.append(element('identifier', date, type='access'))
+    else:
+        title = '%s %s, %s' % (rng.choice(GIVEN), rng.choice(FAMILY), rng.choice(TOPICS).lower())
+        parts.append('<titleInfo>%s</titleInfo>' % element('title', title))
+        if rng.random() < 0.3:
+            parts.append('<titleInfo type="alternative">%s</titleInfo>' % element('title', 'Alt ' + title))
+        qualifier = {'qualifier': 'approximate'} if rng.random() < 0.2 else {}
+        parts.append('<originInfo>%s%s</originInfo>' % (
+            element('publisher', holder), element('dateIssued', date, encoding='w3cdtf', keyDate='yes', **qualifier)))
+        parts.extend('<subject>%s</subject>' % person(rng) for _ in range(rng.randint(0, max_names)))
+        parts.extend(person(rng, 'creator') for _ in range(rng.randint(0, max_names)))
+        parts.extend(person(rng, 'contributor') for _ in range(rng.randint(0, max_names)))
+        for role in ['creator', 'contributor']:
+            if rng.random() < 0.5:
+                parts.append('<name type="corporate">%s<role>%s</role></name>' % (
+                    element('namePart', holder), element('roleTerm', role, type='text')))
+        for _ in range(rng.randint(0, 2)):
+            parts.append('<subject><name type="corporate">%s</name></subject>' % element('namePart', holder))
+        parts.append('<physicalDescription>%s</physicalDescription>' % element(
+            'extent', rng.choice(['1 photograph : black and white', '1 sound recording (30 min.) ; digital'])))
+        parts.append(element('abstract', ' '.join(rng.choice(TOPICS) for _ in range(rng.randint(5, 60)))))
+        parts.extend('<subject>%s</subject>' % element('topic', rng.choice(TOPICS))
+                     for _ in range(rng.randint(0, max_subjects)))
+        if rng.random() < 0.3:
+            parts.append('<subject><geographic>%s</geographic></subject>' % element('cartographics', '49.7, -117.1'))
+        parts.append('<subject>%s</subject>' % element('geographic', rng.choice(PLACES)))
+        parts.append('<subject>%s</subject>' % element('temporal', '1980-1990'))
+        parts.append(element('genre', rng.choice(['photographs', 'interview']), authority='marcgt'))
+        parts.append(element('note', 'Synthetic record %d' % num))
+        parts.extend('<language>%s</language>' % element('languageTerm', rng.choice(LANGUAGES), type='text')
+                     for _ in range(rng.randint(0, max_languages)))
+        parts.append(element('typeOfResource', resource_type))
+        parts.append(element('identifier', '%s_%d.tif' % (repo.upper(), num), type='access'))
+        parts.append(element('identifier', '%03d_%04d' % (num // 1000, num % 1000), type='local'))
+        parts.append('<location>%s</location>' % element('physicalLocation', holder))
+        parts.append('<relatedItem type="host"><titleInfo>%s</titleInfo></relatedItem>' % element(
+            'title', holder + ' Collection'))
+        parts.append('<relatedItem type="host">%s</relatedItem>' % element('identifier', repo + ':' + kind,
+                                                                           type='PID'))
+
+    parts.append(element('accessCondition', 'Provided for research and reference use only. Permission must be '
+                                            'obtained from the ' + holder, type='use and reproduction',
+                         displayLabel='Restricted'))
+    parts.append(element('accessCondition', 'http://rightsstatements.org/vocab/CNE/1.0/',
+                         type='use and reproduction', displayLabel='Rights Statement'))
+    parts.append('<recordInfo>%s%s</recordInfo>' % (element('recordOrigin', '4.3'),
+                                                    element('recordCreationDate', '2019-12-11')))
+    parts.append('</mods>\n')
+    return '\n'.join(parts)
+
+
+def generate_corpus(folder, records, kind='photographs', seed=0, per_folder=10000, **options):
+    """
+    Writes a synthetic collection, in sub folders of per_folder files
+    :param folder: the folder to write to
+    :param records: the number of records
+    :param kind: the collection kind, see kinds
+    :param seed: the random seed, the same seed gives the same corpus
+    :param per_folder: the number of files per sub folder
+    :param options: max_names, max_subjects and max_languages for generate_record
+    :return: None
+    """
+    rng = random.Random(seed)
+    repo = kinds[kind][0]
+    for num in range(1, records + 1):
+        sub_folder = os.path.join(folder, '%04d' % ((num - 1) // per_folder))
+        if (num - 1) % per_folder == 0:
+            os.makedirs(sub_folder, exist_ok=True)
+        with open(os.path.join(sub_folder, '%s_%d.xml' % (repo, num)), 'w', encoding='utf8') as outfile:
+            outfile.write(generate_record(kind, num, rng, **options))
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and its finished children (worker pools)
+    :return: MB as float, None where unsupported
+    """
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB elsewhere
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / scale
+
+
+class PhaseTimer(object):
+    """
+    Times the discovery, parse and map phases by wrapping logic's functions.
+    Parse and map can only be timed in this process, i.e. with one worker
+    """
+
+    def __init__(self):
+        self.phases = {'discovery': 0.0, 'parse': 0.0, 'map': 0.0}
+
+    def timed(self, phase, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.phases[phase] += time.perf_counter() - start
+        return wrapper
+
+    def install(self):
+        logic.get_mods_files = self.timed('discovery', logic.get_mods_files)
+        for name, engine in list(logic.engines.items()):
+            logic.engines[name] = engine._replace(parse=self.timed('parse', engine.parse),
+                                                  row=self.timed('map', engine.row))
+
+
+def measure(corpus, engine='soup', mode='buffered', workers=1):
+    """
+    Converts a corpus once and measures it, meant to run in a fresh process (see run)
+    :param corpus: the corpus folder
+    :param engine: the extraction engine, see logic.engines
+    :param mode: the conversion mode, see modes
+    :param workers: the number of processes to map files with
+    :return: dict of the measurements
+    """
+    timer = PhaseTimer()
+    timer.install()
+    output_folder = tempfile.mkdtemp()
+    options = {'engine': engine, 'workers': workers, 'streaming': mode == 'streaming', 'split_profiles': mode == 'split'}
+
+    start = time.perf_counter()
+    logic.convert_to_csv(corpus, output_folder, 'benchmark.csv', **options)
+    seconds = time.perf_counter() - start
+
+    phases = dict(timer.phases)
+    files = len(logic.get_mods_files(corpus))
+    if workers > 1:
+        del phases['parse'], phases['map']  # Happened in the worker processes
+    else:
+        phases['write'] = seconds - sum(phases.values())  # Writing plus the glue in between
+
+    for filename in os.listdir(output_folder):
+        os.remove(os.path.join(output_folder, filename))
+    os.rmdir(output_folder)
+
+    return {
+        'files': files,
+        'seconds': seconds,
+        'files_per_sec': files / seconds if seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'phases': phases,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(corpus, engines, run_modes, worker_counts, repeat=1, results='bench_results.jsonl'):
+    """
+    Measures every combination of engine, mode and worker count, each in a fresh process
+    :return: list of result dicts, also appended to the results file
+    """
+    commit = git_commit()
+    output = []
+    for engine in engines:
+        for mode in run_modes:
+            for workers in worker_counts:
+                for _ in range(repeat):
+                    proc = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), 'measure', corpus, '--engine', engine,
+                         '--mode', mode, '--workers', str(workers)],
+                        capture_output=True, text=True, check=True
+                    )
+                    result = {
+                        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'commit': commit,
+                        'corpus': os.path.normpath(corpus),
+                        'engine': engine,
+                        'mode': mode,
+                        'workers': workers,
+                    }
+                    result.update(json.loads(proc.stdout))
+                    output.append(result)
+                    print(format_result(result))
+
+    if results:
+        with open(results, 'a', encoding='utf8') as outfile:
+            for result in output:
+                outfile.write(json.dumps(result) + '\n')
+    return output
+
+
+def format_result(result):
+    phases = ', '.join('%s %.2fs' % item for item in result['phases'].items())
+    rss = '%.0f MB' % result['peak_rss_mb'] if result['peak_rss_mb'] is not None else 'n/a'
+    return '%-5s %-9s x%-2d %7d files %8.2fs %9.1f files/sec  peak RSS %s  (%s)' % (
+        result['engine'], result['mode'], result['workers'], result['files'], result['seconds'],
+        result['files_per_sec'] or 0, rss, phases)
+
+
+def compare(results='bench_results.jsonl'):
+    """
+    Prints the latest result of each configuration against the one before it
+    :param results: the results file
+    :return: None
+    """
+    history = {}
+    with open(results, 'r', encoding='utf8') as infile:
+        for line in infile:
+            result = json.loads(line)
+            config = (result['corpus'], result['engine'], result['mode'], result['workers'])
+            history.setdefault(config, []).append(result)
+
+    for config, config_results in sorted(history.items()):
+        latest = config_results[-1]
+        line = '%s  %s' % (config[0], format_result(latest))
+        if len(config_results) > 1:
+            previous = config_results[-2]
+            change = (latest['files_per_sec'] / previous['files_per_sec'] - 1) * 100
+            line += '  %+.1f%% vs %s' % (change, previous['commit'] or previous['timestamp'])
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks convert_to_csv on synthetic MODS collections')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='generate a synthetic corpus')
+    gen.add_argument('folder')
+    gen.add_argument('--records', type=int, default=10000)
+    gen.add_argument('--kind', choices=sorted(kinds), default='photographs')
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--max-names', type=int, default=3)
+    gen.add_argument('--max-subjects', type=int, default=5)
+    gen.add_argument('--max-languages', type=int, default=2)
+
+    bench = commands.add_parser('run', help='measure conversions of a corpus')
+    bench.add_argument('corpus')
+    bench.add_argument('--engine', nargs='+', choices=sorted(logic.engines), default=['soup'])
+    bench.add_argument('--mode', nargs='+', choices=modes, default=['buffered'])
+    bench.add_argument('--workers', nargs='+', type=int, default=[1])
+    bench.add_argument('--repeat', type=int, default=1)
+    bench.add_argument('--results', default='bench_results.jsonl', help='file to append results to, empty for none')
+
+    single = commands.add_parser('measure', help='measure one conversion and print JSON (used by run)')
+    single.add_argument('corpus')
+    single.add_argument('--engine', choices=sorted(logic.engines), default='soup')
+    single.add_argument('--mode', choices=modes, default='buffered')
+    single.add_argument('--workers', type=int, default=1)
+
+    comp = commands.add_parser('compare', help='compare the latest results with the previous ones')
+    comp.add_argument('--results', default='bench_results.jsonl')
+
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        start = time.perf_counter()
+        generate_corpus(args.folder, args.records, args.kind, args.seed, max_names=args.max_names,
+                        max_subjects=args.max_subjects, max_languages=args.max_languages)
+        print('Generated %d records in %.2fs' % (args.records, time.perf_counter() - start))
+    elif args.command == 'run':
+        run(args.corpus, args.engine, args.mode, args.workers, args.repeat, args.results)
+    elif args.command == 'measure':
+        print(json.dumps(measure(args.corpus, args.engine, args.mode, args.workers)))
+    elif args.command == 'compare':
+        compare(args.results)
+
+
+if __name__ == '__main__':
+    main()
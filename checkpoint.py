@@ -0,0 +1,116 @@
+"""
+Checkpoints for resuming long conversions.
+
+The checkpoint is a SQLite file next to the output file. Each file's row is stored
+under its place in the sorted file list as soon as it is mapped, and committed every
+CHECKPOINT_ROWS files, so a conversion that is killed can carry on from the last
+commit when it is run again. The output is written from the checkpoint at the end.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+CHECKPOINT_ROWS = 1000  # Files mapped between commits
+
+
+def checkpoint_path(output_path):
+    """
+    Gets the checkpoint path for an output file
+    :param output_path: the output path e.g. out/collection.csv
+    :return: the checkpoint path e.g. out/collection.checkpoint.sqlite
+    """
+    return os.path.splitext(output_path)[0] + '.checkpoint.sqlite'
+
+
+def listing_hash(files):
+    """
+    Hashes a file list, a checkpoint only applies to the list it was made for
+    :param files: the sorted MODS XML file names
+    :return: the hex digest str
+    """
+    sha = hashlib.sha256()
+    for filename in files:
+        sha.update(filename.encode('utf-8', 'surrogateescape') + b'\0')
+    return sha.hexdigest()
+
+
+class Checkpoint(object):
+    """
+    SQLite store of the rows mapped so far, by position in the file list. Files that failed in
+    a fail-soft conversion (see errors.py) are stored with their failure instead of a row
+    """
+
+    def __init__(self, path, files, profile):
+        """
+        Opens a checkpoint, starting it over if it was made for other files or another profile
+        :param path: the checkpoint path, see checkpoint_path
+        :param files: the sorted MODS XML file names
+        :param profile: the collection profile, see logic.profiles
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS rows (position INTEGER PRIMARY KEY, row TEXT, failure TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        meta = dict(self.conn.execute('SELECT name, value FROM meta'))
+        expected = {'listing': listing_hash(files), 'profile': profile}
+        if meta != expected:
+            self.conn.execute('DELETE FROM rows')
+            self.conn.execute('DELETE FROM meta')
+            self.conn.executemany('INSERT INTO meta VALUES (?, ?)', expected.items())
+            self.conn.commit()
+        # Rows are only ever added in order, so the positions done are 0 to done - 1
+        (self.done,) = self.conn.execute('SELECT COUNT(*) FROM rows').fetchone()
+        self.pending = 0
+
+    def add(self, position, row=None, failure=None):
+        """
+        Stores a mapped file
+        :param position: the file's place in the file list, the next one after done
+        :param row: the row dict, None if the file failed
+        :param failure: the failure dict from errors.failure, None if the file was mapped
+        :return: None
+        """
+        self.conn.execute('INSERT OR REPLACE INTO rows VALUES (?, ?, ?)', (
+            position, json.dumps(row) if row is not None else None,
+            json.dumps(failure) if failure is not None else None))
+        self.done = position + 1
+        self.pending += 1
+        if self.pending >= CHECKPOINT_ROWS:
+            self.commit()
+
+    def rows(self):
+        """
+        Gets the stored rows, in file order and without the failed files
+        :return: generator of row dicts
+        """
+        for (row,) in self.conn.execute('SELECT row FROM rows WHERE row IS NOT NULL ORDER BY position'):
+            yield json.loads(row)
+
+    def failures(self):
+        """
+        Gets the stored failures, in file order
+        :return: list of failure dicts
+        """
+        return [json.loads(failure) for (failure,) in
+                self.conn.execute('SELECT failure FROM rows WHERE failure IS NOT NULL ORDER BY position')]
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        """
+        Commits the files mapped since the last commit and closes the checkpoint
+        :return: None
+        """
+        self.commit()
+        self.conn.close()
+
+    def remove(self):
+        """
+        Closes and deletes the checkpoint, once the output is written
+        :return: None
+        """
+        self.close()
+        os.remove(self.path)
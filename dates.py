@@ -0,0 +1,62 @@
+"""
+Date normalization for the DateCreated column.
+
+The same dateIssued values repeat thousands of times across a collection, so
+normalized dates are cached (up to CACHE_SIZE distinct values per process) and
+the badly formatted ones are only converted the first time they are seen.
+"""
+import datetime
+import re
+from functools import lru_cache
+
+CACHE_SIZE = 4096  # Distinct dateIssued values remembered
+
+LETTER_DATE = re.compile(r'^[A-Z][a-z]{2}-\d{2}$')  # %b-%y date (e.g. Jun-17)
+DAY_FIRST_DATE = re.compile(r'^\d{2}-\d{2}-[1-2]\d{3}$')  # %d-%m-%Y date (e.g. 21-01-1917)
+
+
+def convert_date(dt_str, letter_date):
+    """
+    Converts an invalid formatted date into a proper date for ARCA Mods
+    Correct format:  Y-m-d
+    Fixes:
+    Incorrect format: m-d-Y
+    Incorrect format (letter date): m-d e.g. Jun-17
+    :param dt_str: the date string
+    :param letter_date: whether the string is a letter date. Letter date is something like Jun-17
+    :return: the correctly formatted date
+    """
+    if letter_date:
+        rev_date = datetime.datetime.strptime(dt_str, '%b-%y').strftime('%Y-%m')  # convert date to yymm string format
+        rev_date_pts = rev_date.split("-")
+        year_num = int(rev_date_pts[0])
+        if year_num > 1999:
+            year_num = year_num - 100
+        year_str = str(year_num)
+        rev_date_pts[0] = year_str
+        revised = "-".join(rev_date_pts)
+
+    else:
+        revised = datetime.datetime.strptime(dt_str, '%d-%m-%Y').strftime(
+            '%Y-%m-%d')  # convert date to YY-mm string format
+
+    return revised
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize_date(date_cr):
+    """
+    Fixes the raw keyDate dateIssued value into the DateCreated value
+    :param date_cr: the stripped dateIssued text, None if not found
+    :return: date value as str
+    """
+    if not date_cr:
+        return 'n.d.'
+
+    # Fix badly formatted dates (either of the two patterns declared above will be fixed)
+    if LETTER_DATE.match(date_cr):
+        date_cr = convert_date(date_cr, True)
+    elif DAY_FIRST_DATE.match(date_cr):
+        date_cr = convert_date(date_cr, False)
+
+    return date_cr
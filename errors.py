@@ -0,0 +1,144 @@
+"""
+Per file errors of fail-soft conversions.
+
+In fail-soft mode a file that can't be read, parsed or mapped is left out of the
+output instead of stopping the conversion. Each failure is written to an error
+report (CSV, or JSON lines for a .jsonl path) with the file, the column being
+mapped and the traceback, and the file can be copied to a quarantine folder.
+"""
+import csv
+import json
+import os
+import shutil
+import traceback
+
+FIELDS = ['filename', 'column', 'error', 'message', 'traceback']  # The error report columns
+
+
+class MappingError(Exception):
+    """
+    Raised when a column of a parsed file can't be mapped, the original error is the cause
+    """
+
+    def __init__(self, column, filename):
+        super().__init__('%s could not be mapped for %s' % (column, filename))
+        self.column = column
+        self.filename = filename
+
+
+def failure(filename, error):
+    """
+    Describes a failed file. Tracebacks can't be pickled, so this is done where the error happened
+    :param filename: the MODS XML file name
+    :param error: the exception, a MappingError for mapping errors and anything else for reading or parsing
+    :return: dict of the FIELDS
+    """
+    if isinstance(error, MappingError) and error.__cause__ is not None:
+        column, error = error.column, error.__cause__
+    else:
+        column = '<parse>'
+    return {
+        'filename': filename,
+        'column': column,
+        'error': type(error).__name__,
+        'message': str(error),
+        'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+    }
+
+
+def guarded(func, filename, *args):
+    """
+    Calls a function of a MODS XML file, catching any error.
+    Use partial(guarded, func) to pass it to logic.file_map
+    :param func: a module level function whose first argument is the file name
+    :param filename: the MODS XML file name
+    :param args: the other arguments of func
+    :return: tuple of what func returned and None, or None and the failure dict
+    """
+    try:
+        return func(filename, *args), None
+    except Exception as e:
+        return None, failure(filename, e)
+
+
+class ErrorReport(object):
+    """
+    Writes failures as they come in, so the report is complete even if the conversion is stopped
+    """
+
+    def __init__(self, path, quarantine=None, input_folder=None):
+        """
+        :param path: the report path, .jsonl for JSON lines and CSV otherwise
+        :param quarantine: the folder to copy failed files to, None to not copy them
+        :param input_folder: the collection folder, quarantined files keep their path relative to it
+        """
+        self.path = path
+        self.quarantine = quarantine
+        self.input_folder = input_folder
+        self.count = 0
+        self.outfile = open(path, 'w', encoding='utf-8', newline='')
+        if path.endswith('.jsonl'):
+            self.writer = None
+        else:
+            self.writer = csv.DictWriter(self.outfile, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def add(self, failed):
+        """
+        Records a failed file
+        :param failed: the failure dict, see failure
+        :return: None
+        """
+        if self.writer is None:
+            self.outfile.write(json.dumps(failed) + '\n')
+        else:
+            self.writer.writerow(failed)
+        self.outfile.flush()
+        self.count += 1
+        if self.quarantine is not None:
+            try:
+                self.copy(failed['filename'])
+            except OSError:
+                pass  # e.g. the file can't be read, which is in the report already
+
+    def copy(self, filename):
+        """
+        Copies a failed file to the quarantine folder
+        :param filename: the MODS XML file name
+        :return: the path of the copy
+        """
+        # Keep the relative path so files with the same name in different folders don't clash
+        name = os.path.relpath(filename, self.input_folder) if self.input_folder else os.path.basename(filename)
+        if name.startswith(os.pardir):
+            name = os.path.basename(filename)
+        path = os.path.join(self.quarantine, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy2(filename, path)
+        return path
+
+    def passed(self, results):
+        """
+        Records the failures of guarded results and drops them
+        :param results: iterable of (result, failure) tuples from guarded
+        :return: generator of the results of the files that didn't fail
+        """
+        for result, failed in results:
+            if failed is None:
+                yield result
+            else:
+                self.add(failed)
+
+    def close(self):
+        self.outfile.close()
+
+
+def read_report(path):
+    """
+    Reads an error report
+    :param path: the report path, see ErrorReport
+    :return: list of failure dicts
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as infile:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in infile if line.strip()]
+        return list(csv.DictReader(infile))
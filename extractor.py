@@ -0,0 +1,317 @@
+"""
+Single pass MODS extraction engine.
+
+Walks each MODS XML document once with lxml's iterparse, indexing every element
+by tag and by (tag, attribute, value), then maps the columns from the index. The
+mappings are compiled from mappings.spec, the rules the bs4 functions in mappings.py
+are compiled from, so both engines map the same columns to the same values.
+"""
+import re
+from io import BytesIO
+
+from lxml import etree
+
+from mappings import get_store, image_link, key, pid, post_processors, spec
+
+# One step of a CSS selector, a tag with an optional [attribute=value]
+SELECTOR_STEP = re.compile(r'(\w+)(?:\[(\w+)="?([^"\]]*)"?\])?$')
+
+
+def local_name(tag: str):
+    """
+    Strips the namespace from an lxml tag
+    :param tag: the tag e.g. {http://www.loc.gov/mods/v3}title
+    :return: the local name e.g. title
+    """
+    return tag.rpartition('}')[2]
+
+
+def get_text(el):
+    """
+    Text of an element and all its descendants, same as bs4's getText()
+    :param el: the lxml element
+    :return: the text as str
+    """
+    parts = [el.text or '']
+    for child in el:
+        if isinstance(child.tag, str):  # Skip comment and processing instruction text
+            parts.append(get_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def stripped_text(el):
+    """
+    Stripped text of an element
+    :param el: the lxml element, or None
+    :return: str if element exists, else None
+    """
+    return get_text(el).strip() if el is not None else None
+
+
+class Document(object):
+    """
+    Elements collected from one pass over a MODS document
+    """
+
+    def __init__(self):
+        self.index = {}  # tag or (tag, attribute, value) -> elements in document order, see indexed
+        self.stores = {}  # Per document stores, see mappings.get_store
+        self.root = None  # The tag of the root element
+        self.filename = None
+        self.i = None
+
+    def start(self, el):
+        """
+        Records an element as it is opened during the walk
+        :param el: the lxml element
+        :return: None
+        """
+        tag = local_name(el.tag)
+        if self.root is None:
+            self.root = tag
+        index = self.index
+        index.setdefault(tag, []).append(el)
+        for attr, value in el.attrib.items():
+            index.setdefault((tag, local_name(attr), value), []).append(el)
+
+
+def scan(source):
+    """
+    Walks a MODS document exactly once
+    :param source: the filename or file object of the MODS XML
+    :return: the Document holding the collected elements
+    """
+    doc = Document()
+    # huge_tree lifts libxml2's limit on text size, e.g. long abstracts would otherwise be cut short
+    for _, el in etree.iterparse(source, events=('start',), recover=True, huge_tree=True):
+        doc.start(el)
+    return doc
+
+
+def parent_name(el):
+    parent = el.getparent()
+    return local_name(parent.tag) if parent is not None else None
+
+
+def indexed(doc: Document, field: str, attrs=None, parent=None):
+    """
+    Gets elements from the document's index, same as mappings.indexed
+    :param doc: the Document made by load
+    :param field: the tag name to search for
+    :param attrs: the attributes of the element, None for none
+    :param parent: the tag name the element's parent must have, None for any
+    :return: list of elements in document order, do not modify
+    """
+    if attrs:
+        (attr, value), *rest = attrs.items()
+        elements = doc.index.get((field, attr, value), [])
+        if rest:
+            elements = [el for el in elements if all(el.get(k) == v for k, v in rest)]
+    else:
+        elements = doc.index.get(field, [])
+    if parent is not None:
+        elements = [el for el in elements if parent_name(el) == parent]
+    return elements
+
+
+def find_descendant(el, where: dict):
+    """
+    First descendant of el matching a {'find': tag, 'attrs': ..., 'string': ...} part of a rule
+    :param el: the lxml element
+    :param where: the dict, see mappings.spec
+    :return: the element if found, else None
+    """
+    attrs, string = where.get('attrs') or {}, where.get('string')
+    for desc in el.iter('{*}' + where['find']):
+        if desc is not el and all(desc.get(k) == v for k, v in attrs.items()) and \
+                (string is None or (len(desc) == 0 and desc.text == string)):
+            return desc
+    return None
+
+
+def compile_select(selector: str):
+    """
+    Compiles a CSS selector of child steps e.g. relatedItem[type=host] > titleInfo > title, the only kind the
+    spec uses
+    :param selector: the selector string
+    :return: function of the Document -> list of matching elements in document order
+    """
+    steps = []
+    for step in selector.split('>'):
+        match = SELECTOR_STEP.match(step.strip())
+        if match is None:
+            raise ValueError('The lxml engine does not support the selector %s' % selector)
+        tag, attr, value = match.groups()
+        steps.append((tag, {attr: value} if attr else None))
+    (field, attrs), ancestors = steps[-1], steps[-2::-1]
+
+    def matches(el):
+        for tag, step_attrs in ancestors:
+            el = el.getparent()
+            if el is None or local_name(el.tag) != tag or \
+                    not all(el.get(k) == v for k, v in (step_attrs or {}).items()):
+                return False
+        return True
+
+    return lambda doc: [el for el in indexed(doc, field, attrs) if matches(el)]
+
+
+def compile_elements(rule: dict):
+    """
+    Compiles the element lookup of a rule, see mappings.compile_elements
+    :param rule: the spec rule
+    :return: function of the Document -> list of matching elements in document order
+    """
+    if 'select' in rule:
+        find = compile_select(rule['select'])
+    else:
+        field, attrs, parent = rule['find'], rule.get('attrs'), rule.get('parent')
+
+        def find(doc):
+            return indexed(doc, field, attrs, parent)
+
+    tests = [(rule[k], k == 'has') for k in ('has', 'lacks') if k in rule]
+    if not tests:
+        return find
+    return lambda doc: [el for el in find(doc)
+                        if all((find_descendant(el, where) is not None) == want for where, want in tests)]
+
+
+def compile_value(where, attribute=None):
+    """
+    Compiles how the value is taken from a found element, see mappings.compile_value
+    :param where: the {'find': tag, 'attrs': ...} descendant holding the value, None for the element itself
+    :param attribute: the attribute holding the value, None for the text
+    :return: function of the element -> the value, None if not found
+    """
+    if attribute is not None:
+        return lambda el: el.get(attribute)
+    if where is not None:
+        return lambda el: stripped_text(find_descendant(el, where))
+    return stripped_text
+
+
+def compile_column(rule: dict):
+    """
+    Compiles a single column rule, see mappings.compile_column
+    :param rule: the spec rule
+    :return: the mapping function of the Document -> the value
+    """
+    elements = compile_elements(rule)
+    value = compile_value(rule.get('child'), rule.get('attribute'))
+    occurrence = rule.get('occurrence', 0)
+    post = post_processors[rule['post']] if 'post' in rule else None
+    default = rule.get('default')
+
+    def mapping(doc):
+        found = elements(doc)
+        result = value(found[occurrence]) if -len(found) <= occurrence < len(found) else None
+        if result is None:
+            return default
+        return post(result) if post is not None else result
+
+    if rule.get('shared'):
+        name, compute = rule['column'], mapping
+
+        def mapping(doc):
+            return get_store(doc, name, lambda doc: {name: compute(doc)})[name]
+    return mapping
+
+
+def compile_group(rule: dict):
+    """
+    Compiles a numbered group of columns, see mappings.compile_group
+    :param rule: the spec rule
+    :return: dict of column -> mapping function of the Document -> the value
+    """
+    elements = compile_elements(rule)
+    values = [(fmt, compile_value(where)) for fmt, where in rule['columns'].items()]
+    name = ' '.join(rule['columns'])  # Store name
+
+    def populate(doc):
+        store = {}
+        x = 1
+        for el in elements(doc):
+            found = [(fmt, value(el)) for fmt, value in values]
+            if all(result is not None for _, result in found):
+                for fmt, result in found:
+                    store[fmt % x] = result
+                x += 1
+        return store
+
+    def column(col):
+        return lambda doc: get_store(doc, name, populate).get(col)
+
+    return {fmt % x: column(fmt % x) for x in range(1, rule['count'] + 1) for fmt in rule['columns']}
+
+
+def title(doc: Document):
+    """
+    Same as mappings.title, except a record without a title maps to None
+    :param doc: the Document
+    :return: the title as str
+    """
+    titles = indexed(doc, 'title')
+    _title = stripped_text(titles[0]) if titles else None
+    date_cr = mappings['DateCreated'](doc)
+    if _title is not None and (indexed(doc, 'dateIssued', {'qualifier': 'Estimated'}) or
+                               indexed(doc, 'dateIssued', {'qualifier': 'approximate'})) and \
+            _title.find("ca. ") == -1 and date_cr != "n.d.":
+        _title = _title + ", ca. " + date_cr
+    return _title
+
+
+# The lxml versions of mappings.functions, key, pid and image_link only use the row number and filename
+functions = {'key': key, 'pid': pid, 'image_link': image_link, 'title': title}
+
+
+def compile_spec(rules):
+    """
+    Compiles a column spec into mapping functions of a Document, see mappings.compile_spec
+    :param rules: the list of rules, see mappings.spec
+    :return: dict of column -> mapping function of the Document -> the value (None when not found)
+    """
+    compiled = {}
+    for rule in rules:
+        if 'func' in rule:
+            if rule['func'] not in functions:
+                raise ValueError('The lxml engine has no %s function, add it to extractor.functions' % rule['func'])
+            compiled[rule['column']] = functions[rule['func']]
+        elif 'columns' in rule:
+            compiled.update(compile_group(rule))
+        else:
+            compiled[rule['column']] = compile_column(rule)
+    return compiled
+
+
+mappings = compile_spec(spec)
+
+
+def build_row(doc: Document):
+    """
+    Builds every column in mappings from a loaded document
+    :param doc: the Document made by load
+    :return: dict of column -> value (None when not found)
+    """
+    return {col: mapping(doc) for col, mapping in mappings.items()}
+
+
+def load(filename: str, i: int, contents=None):
+    """
+    Scans a MODS XML file and sets its row number and filename
+    :param filename: the MODS XML filename
+    :param i: the row number
+    :param contents: the file contents from reader.open_input if already read (see reader.prefetch),
+    None to read the file
+    :return: the Document
+    """
+    if contents is not None and not hasattr(contents, 'read'):
+        contents = BytesIO(contents)  # An mmap is scanned in place
+    doc = scan(contents if contents is not None else filename)
+    # recover lets through documents with nothing in them, e.g. a file of plain text
+    if doc.root != 'mods':
+        raise ValueError('%s is not a MODS document' % filename)
+    doc.filename = filename
+    doc.i = i
+    return doc
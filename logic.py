@@ -1,16 +1,118 @@
 import os
 import pandas as pd
-from bs4 import BeautifulSoup
-import glob
-import datetime
 import re
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import translate
+from collections import namedtuple
+from functools import partial
+from itertools import chain, repeat
+from dates import convert_date  # Part of this module's API, it used to be defined here
 from mappings import mappings
-from mappings import reset
+from mappings import indexed, load_soup
+import extractor
+from checkpoint import Checkpoint, checkpoint_path
+from errors import ErrorReport, MappingError, guarded
+from manifest import Manifest, manifest_path
+from profiler import ColumnProfiler
+from reader import open_input, prefetch
+from writers import compressions, formats, open_writer, write_rows
+
+# updated for **Rev 18.5 of the Master Metadata Sheet**
+col_names = [
+    'key', 'imageLink', 'PID', 'Filename', 'Directory', 'child_key', 'Title', 'AlternativeTitle', 'Creator1_Given',
+    'Creator1_Family', 'CorporateCreator', 'Contributor1_Given', 'Contributor1_Family', 'Contributor2_Given',
+    'Contributor2_Family', 'CorporateContributor',
+    'Publisher_Original', 'DateCreated', 'Description', 'Extent', 'Subject1_Topic', 'Subject2_Topic',
+    'Subject3_Topic',
+    'Subject4_Topic', 'Subject5_Topic', 'Subject_Geographic', 'Coordinates', 'Subject1_Given', 'Subject1_Family',
+    'Subject2_Given', 'Subject2_Family', 'Subject3_Given', 'Subject3_Family', 'CorporateSubject_1',
+    'CorporateSubject_2', 'DateRange', 'Genre', 'GenreAuthority', 'Type', 'internetMediaType', 'Language1',
+    'Language2', 'Notes', 'AccessIdentifier', 'LocalIdentifier', 'ISBN', 'Classification', 'URI', 'Source',
+    'Rights',
+    'CreativeCommons_URI', 'RightsStatement', 'relatedItem_Title', 'relatedItem_PID', 'recordCreationDate',
+    'recordOrigin'
+]
+
+news_col_names = [
+    'key', 'Filename', 'Identifier', 'IssueTitle', 'DateCreated', 'Volume', 'Issue',
+    'Rights', 'CreativeCommons_URI', 'RightsStatement'
+]
+
+
+def compile_patterns(patterns):
+    """
+    Compiles file name patterns into one regex, matched with the case rules of the OS like glob
+    :param patterns: the patterns e.g. ['*.xml']
+    :return: the match function of a name, None if there are no patterns
+    """
+    if not patterns:
+        return None
+    regex = re.compile('|'.join(translate(os.path.normcase(pattern)) for pattern in patterns))
+    return lambda name: regex.match(os.path.normcase(name)) is not None
+
+
+def iter_mods_files(input_folder, include=('*.xml',), exclude=(), max_depth=None):
+    """
+    Walks a folder with os.scandir, yielding the MODS XML files as they are found in no particular order.
+    Hidden files and folders are skipped and unreadable folders ignored, same as glob
+    :param input_folder: the input folder containing XML files
+    :param include: the file name patterns to yield e.g. *.xml, at least one
+    :param exclude: the patterns of file or folder names, or of paths relative to input_folder
+    (with / separators), to skip e.g. *_TN.xml or drafts/*
+    :param max_depth: how many folders down to look, 0 for the input folder only, None for no limit
+    :return: generator of file names
+    """
+    if not include:
+        raise ValueError('include needs at least one file name pattern e.g. *.xml')
+    included = compile_patterns(include)
+    excluded = compile_patterns(exclude)
+    folders = [(input_folder, '', 0)]
+    while folders:
+        folder, rel_folder, depth = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name[0] == '.':
+                        continue
+                    rel = rel_folder + '/' + name if rel_folder else name
+                    if excluded is not None and (excluded(name) or excluded(rel)):
+                        continue
+                    if entry.is_dir():
+                        if max_depth is None or depth < max_depth:
+                            folders.append((entry.path, rel, depth + 1))
+                    elif included(name) and entry.is_file():
+                        yield entry.path
+        except OSError:
+            continue
+
+
+def get_mods_files(input_folder, include=('*.xml',), exclude=(), max_depth=None, ordered=True):
+    """
+    Finds the MODS XML files in a folder and its sub folders, see iter_mods_files
+    :param input_folder: the input folder containing XML files
+    :param include: the file name patterns to find
+    :param exclude: the file or folder patterns to skip
+    :param max_depth: how many folders down to look, None for no limit
+    :param ordered: whether to sort the files, which conversions need for a deterministic CSV
+    :return: list of file names
+    """
+    files = list(iter_mods_files(input_folder, include, exclude, max_depth))
+    return sorted(files) if ordered else files
 
 
-def get_mods_files(input_folder):
-    return \
-        sorted([filename for filename in glob.iglob(os.path.join(input_folder, '**', '*.xml'), recursive=True)])
+def collection_files(input_folder, files=None):
+    """
+    Gets the files to convert, raises ValueError when there are none
+    :param input_folder: the input folder containing XML files
+    :param files: the sorted MODS XML files of the folder if listed already, None to find them with get_mods_files
+    :return: list of file names
+    """
+    if files is None:
+        files = get_mods_files(input_folder)
+    if not files:
+        raise ValueError('No XML files found in %s' % input_folder)
+    return files
 
 
 def multi_hdg_mkr(pt1, num, pt2):
@@ -24,32 +126,293 @@ def multi_hdg_mkr(pt1, num, pt2):
     return pt1 + str(num) + '_' + pt2
 
 
-def convert_date(dt_str, letter_date):
+def parse_soup(filename, i, contents=None):
+    """
+    Parses a MODS XML file for the bs4 functions in mappings.py
+    :param filename: the MODS XML file name
+    :param i: the row number
+    :param contents: the file contents from reader.open_input if already read (see reader.prefetch),
+    None to read the file
+    :return: the bs4 object
+    """
+    if contents is None:
+        contents = open_input(filename)
+
+    # Load the UTF-8 bytes into beautifulsoup to parse xml, without decoding them first
+    return load_soup(contents, i, filename)
+
+
+def soup_profile(soup):
+    """
+    Identifies the profile of a parsed MODS, newspapers have a volume detail
+    :param soup: the bs4 object
+    :return: the profile name, see profiles
+    """
+    return 'newspaper' if indexed(soup, 'detail', {'type': 'volume'}) else 'default'
+
+
+def map_columns(doc, cols, columns, profiler=None):
+    """
+    Maps a parsed MODS XML file column by column, an error names the column it happened in
+    :param doc: the parsed document
+    :param cols: the columns to map
+    :param columns: dict of column -> mapping function of the document, e.g. mappings.mappings
+    :param profiler: a ColumnProfiler to time each mapping call with, None for none
+    :return: dict of column -> value for found values
+    """
+    row = {}
+    for col in cols:
+        if col not in columns:
+            continue
+        try:
+            if profiler is None:
+                val = columns[col](doc)
+            else:
+                val = profiler.call(col, columns[col], doc)
+        except Exception as e:
+            raise MappingError(col, doc.filename) from e
+        if val:
+            row[col] = val
+    return row
+
+
+def soup_row(soup, cols, profiler=None):
+    """
+    Maps a parsed MODS XML file using the bs4 functions in mappings.py
+    :param soup: the bs4 object
+    :param cols: the columns to map
+    :param profiler: a ColumnProfiler to time each mapping call with, None for none
+    :return: dict of column -> value for found values
+    """
+    return map_columns(soup, cols, mappings, profiler)
+
+
+def lxml_profile(doc):
+    """
+    Identifies the profile of a MODS scanned by extractor.py
+    :param doc: the extractor Document
+    :return: the profile name, see profiles
+    """
+    return 'newspaper' if extractor.indexed(doc, 'detail', {'type': 'volume'}) else 'default'
+
+
+def lxml_row(doc, cols, profiler=None):
+    """
+    Maps a MODS XML file scanned in a single pass by extractor.py
+    :param doc: the extractor Document
+    :param cols: the columns to map
+    :param profiler: a ColumnProfiler to time each mapping call with, None for none
+    :return: dict of column -> value for found values
+    """
+    return map_columns(doc, cols, extractor.mappings, profiler)
+
+
+# An extraction engine parses a file, identifies its profile and maps it to a row.
+# parse(filename, i, contents=None) takes the file contents when they were read ahead
+Engine = namedtuple('Engine', ['parse', 'profile', 'row'])
+
+# Available extraction engines, all produce the same rows
+engines = {
+    'soup': Engine(parse_soup, soup_profile, soup_row),
+    'lxml': Engine(extractor.load, lxml_profile, lxml_row)
+}
+
+# The columns for each collection profile
+profiles = {
+    'default': col_names,
+    'newspaper': news_col_names
+}
+
+
+def get_engine(engine):
+    """
+    Gets an extraction engine
+    :param engine: the engine name (see engines) or an Engine e.g. one wrapped by a ColumnProfiler
+    :return: the Engine
+    """
+    return engines[engine] if isinstance(engine, str) else engine
+
+
+def map_file(filename, i, cols, engine='soup', contents=None):
+    """
+    Parses and maps a MODS XML file to a row
+    :param filename: the MODS XML file name
+    :param i: the row number
+    :param cols: the columns to map
+    :param engine: the extraction engine, see get_engine
+    :param contents: the file contents if already read, None to read the file
+    :return: dict of column -> value for found values
+    """
+    _engine = get_engine(engine)
+    return _engine.row(_engine.parse(filename, i, contents), cols)
+
+
+def pool_map(func, workers, *iterables):
+    """
+    Maps func over the iterables, in a process pool when there is more than one worker.
+    Results always come out in the order of the inputs
+    :param func: a module level function (so it can be pickled)
+    :param workers: the number of processes
+    :param iterables: the argument lists, the first one must support len()
+    :return: generator of results
+    """
+    if workers > 1:
+        chunksize = max(1, min(64, len(iterables[0]) // (workers * 4)))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            yield from executor.map(func, *iterables, chunksize=chunksize)
+        finally:
+            # Don't wait for files nobody will read when stopped early (e.g. Cancelled)
+            executor.shutdown(cancel_futures=True)
+    else:
+        yield from map(func, *iterables)
+
+
+def file_map(func, workers, files, *iterables):
+    """
+    pool_map for functions whose first argument is a MODS XML file name. In a single process the
+    files are read ahead on threads (see reader.prefetch) and passed to func as its last argument,
+    so parsing overlaps with I/O. Worker processes each read their own files
+    :param func: a module level function taking the file contents as its last argument
+    :param workers: the number of processes
+    :param files: the file names
+    :param iterables: the other argument lists
+    :return: generator of results
+    """
+    if workers > 1:
+        yield from pool_map(func, workers, files, *iterables)
+        return
+
+    contents = prefetch(files)
+    try:
+        yield from map(func, files, *iterables, contents)
+    finally:
+        contents.close()
+
+
+class Cancelled(Exception):
+    """
+    Raised by a progress callback to stop a conversion
+    """
+
+
+def with_progress(results, files, progress, start=0):
+    """
+    Reports progress as each file's result comes in
+    :param results: iterable of results, one per file in files from start on
+    :param files: the file names, in the order of results
+    :param progress: callable(done, total, filename), None for no reporting.
+    It can raise Cancelled to stop the conversion
+    :param start: the number of files done already e.g. by an earlier run that was resumed
+    :return: generator of the results
+    """
+    if progress is None:
+        yield from results
+        return
+
+    total = len(files)
+    for done, (filename, result) in enumerate(zip(files[start:], results), start + 1):
+        progress(done, total, filename)
+        yield result
+
+
+def map_files(files, cols, engine='soup', workers=1, start=0, fail_soft=False):
+    """
+    Maps each file to a row. With more than one worker the files are mapped in a
+    process pool, rows still come out in the order of files
+    :param files: the sorted MODS XML file names
+    :param cols: the columns to map
+    :param engine: the extraction engine, see get_engine
+    :param workers: the number of processes to map files with
+    :param start: the row number of the first file
+    :param fail_soft: whether to catch each file's errors, see errors.guarded
+    :return: generator of row dicts, or with fail_soft of (row dict, failure) tuples
+    """
+    n = len(files)
+    func = partial(guarded, map_file) if fail_soft else map_file
+    return file_map(func, workers, files, range(start, start + n), repeat(cols, n), repeat(engine, n))
+
+
+def map_doc(filename, doc, cols, engine='soup'):
+    """
+    Maps a file that was parsed already, e.g. by detect_profile
+    :param filename: the MODS XML file name, for errors.guarded
+    :param doc: the parsed document
+    :param cols: the columns to map
+    :param engine: the extraction engine, see get_engine
+    :return: dict of column -> value for found values
+    """
+    return get_engine(engine).row(doc, cols)
+
+
+def map_parsed(files, cols, engine='soup', workers=1, first_doc=None, first_index=0, fail_soft=False, start=0):
     """
-    Converts an invalid formatted date into a proper date for ARCA Mods
-    Correct format:  Y-m-d
-    Fixes:
-    Incorrect format: m-d-Y
-    Incorrect format (letter date): m-d e.g. Jun-17
-    :param dt_str: the date string
-    :param letter_date: whether the string is a letter date. Letter date is something like Jun-17
-    :return: the correctly formatted date
+    map_files that maps the already parsed document of one of the files instead of parsing it again
+    :param files: the sorted MODS XML file names
+    :param cols: the columns to map
+    :param engine: the extraction engine, see get_engine
+    :param workers: the number of processes to map the other files with
+    :param first_doc: the parsed document, None to parse every file
+    :param first_index: the position of first_doc's file in files
+    :param fail_soft: whether to catch each file's errors, see errors.guarded
+    :param start: the position in files to start from, e.g. when resuming. Earlier files aren't mapped
+    :return: generator like map_files, for files[start:]
     """
-    if letter_date:
-        rev_date = datetime.datetime.strptime(dt_str, '%b-%y').strftime('%Y-%m')  # convert date to yymm string format
-        rev_date_pts = rev_date.split("-")
-        year_num = int(rev_date_pts[0])
-        if year_num > 1999:
-            year_num = year_num - 100
-        year_str = str(year_num)
-        rev_date_pts[0] = year_str
-        revised = "-".join(rev_date_pts)
+    if first_doc is None or first_index < start:
+        return map_files(files[start:], cols, engine, workers, start, fail_soft)
 
+    filename = files[first_index]
+    if fail_soft:
+        first_row = guarded(map_doc, filename, first_doc, cols, engine)
     else:
-        revised = datetime.datetime.strptime(dt_str, '%d-%m-%Y').strftime(
-            '%Y-%m-%d')  # convert date to YY-mm string format
+        first_row = map_doc(filename, first_doc, cols, engine)
+    before = map_files(files[start:first_index], cols, engine, workers, start, fail_soft) \
+        if first_index > start else []
+    after = map_files(files[first_index + 1:], cols, engine, workers, first_index + 1, fail_soft)
+    return chain(before, [first_row], after)
+
+
+def map_routed_file(filename, engine='soup', contents=None):
+    """
+    Parses a file, identifies its own profile and maps it with that profile's columns.
+    The key is left for the caller, it depends on where the row lands in its profile's CSV
+    :param filename: the MODS XML file name
+    :param engine: the extraction engine, see get_engine
+    :param contents: the file contents if already read, None to read the file
+    :return: tuple of the profile name and the row dict
+    """
+    _engine = get_engine(engine)
+    doc = _engine.parse(filename, 0, contents)
+    profile = _engine.profile(doc)
+    cols = [col for col in profiles[profile] if col != 'key']
+    return profile, _engine.row(doc, cols)
+
+
+def map_profiled_file(filename, cols, engine='soup', contents=None):
+    """
+    Parses and maps a MODS XML file, also identifying the file's own profile
+    :param filename: the MODS XML file name
+    :param cols: the columns to map
+    :param engine: the extraction engine, see get_engine
+    :param contents: the file contents if already read, None to read the file
+    :return: tuple of the profile name and the row dict
+    """
+    _engine = get_engine(engine)
+    doc = _engine.parse(filename, 0, contents)
+    return _engine.profile(doc), _engine.row(doc, cols)
+
 
-    return revised
+def detect_profile(filename, engine='soup'):
+    """
+    Parses the first file of a collection and identifies the collection profile
+    :param filename: the MODS XML file name
+    :param engine: the extraction engine, see get_engine
+    :return: tuple of the profile name and the parsed document, which can be mapped
+    as row 0 without parsing the file again
+    """
+    _engine = get_engine(engine)
+    doc = _engine.parse(filename, 0)
+    return _engine.profile(doc), doc
 
 
 def save(df, path):
@@ -68,110 +431,361 @@ def is_newspaper_issue(filename):
     :param filename: the MODS XML file name
     :return: a boolean indicating whether it is a newspaper
     """
-    with open(filename, "r", encoding="utf8") as infile:
-        contents = infile.read()
+    profile, _ = detect_profile(filename)
+    return profile == 'newspaper'
 
-    # Load contents into beautifulsoup to parse xml
-    soup = BeautifulSoup(contents, 'xml')
-    return soup.find('detail', {'type': 'volume'})
 
+def find_profile(files, engine='soup'):
+    """
+    Identifies the collection profile from the first file that parses, for fail-soft conversions
+    where a malformed first file shouldn't stop the run
+    :param files: the sorted MODS XML file names
+    :param engine: the extraction engine, see get_engine
+    :return: tuple of the profile name, the position of the file in files and its parsed document, which can be
+    mapped without parsing the file again. ('default', None, None) if no file parses
+    """
+    for i, filename in enumerate(files):
+        try:
+            profile, doc = detect_profile(filename, engine)
+        except Exception:
+            continue
+        return profile, i, doc
+    return 'default', None, None
 
-def convert_newspapers_to_csv(files, output_folder, output_file):
-    news_col_names = [
-        'key', 'Filename', 'Identifier', 'IssueTitle', 'DateCreated', 'Volume', 'Issue',
-        'Rights', 'CreativeCommons_URI', 'RightsStatement'
-    ]
-
-    # Create data frame
-    df = pd.DataFrame(columns=news_col_names)
-    df.append(pd.Series(dtype=float), ignore_index=True)
 
-    i = 0  # Keep track of row number in df
-    for filename in files:
-        # Read file contents
-        with open(filename, "r", encoding="utf8") as infile:
-            contents = infile.read()
+def renumber(rows, cols):
+    """
+    Numbers the keys of rows by their place in the output, for when failed files were left out
+    :param rows: iterable of row dicts
+    :param cols: the output columns
+    :return: generator of the row dicts
+    """
+    for i, row in enumerate(rows, 1):
+        if 'key' in cols:
+            row['key'] = str(i)
+        yield row
 
-        # Load contents into beautifulsoup to parse xml
-        soup = BeautifulSoup(contents, 'xml')
 
-        # Set custom attrs
-        soup.i = i
-        soup.filename = filename
+def profile_output_file(output_file, profile):
+    """
+    Gets the CSV file name for one profile of a mixed collection
+    :param output_file: the requested output file name e.g. collection.csv
+    :param profile: the profile name e.g. newspaper
+    :return: the file name e.g. collection_newspaper.csv
+    """
+    stem, ext = os.path.splitext(output_file)
+    return '%s_%s%s' % (stem, profile, ext or '.csv')
 
-        # Set cols
-        for col in news_col_names:
-            if col not in mappings:
-                continue
-            val = mappings[col](soup)
-            if val:
-                df.at[i, col] = val
-        i += 1
-        reset()  # Reset mappings for next file
 
-    save(df, os.path.join(output_folder, output_file))
+def convert_mixed_to_csv(files, output_folder, output_file, engine='soup', workers=1, progress=None, output=None,
+                         report=None):
+    """
+    Converts a folder with several kinds of MODS in one pass, each record is classified
+    on its own and written to the CSV of its profile (see profile_output_file).
+    Keys are numbered per CSV
+    :param files: the sorted MODS XML file names, see collection_files
+    :param output_folder: the output folder to output the CSVs
+    :param output_file: the base name of the CSV files
+    :param engine: the extraction engine, see get_engine
+    :param workers: the number of processes to map files with, rows keep the sorted file order
+    :param progress: callable(done, total, filename) called after each file, see with_progress
+    :param output: dict of output options for writers.open_writer e.g. output_format, None for plain CSV
+    :param report: the errors.ErrorReport to record failed files in and carry on, None to stop at the first error
+    :return: dict of profile name -> the path written (with .gz/.zst when compressed), or the list of
+    part paths when split into parts, for the profiles found
+    """
+    n = len(files)
+    outputs = {}  # profile -> writer
+    try:
+        func = partial(guarded, map_routed_file) if report is not None else map_routed_file
+        mapped = with_progress(file_map(func, workers, files, repeat(engine, n)), files, progress)
+        if report is not None:
+            mapped = report.passed(mapped)
+        for profile, row in mapped:
+            if profile not in outputs:
+                path = os.path.join(output_folder, profile_output_file(output_file, profile))
+                outputs[profile] = open_writer(path, profiles[profile], **(output or {}))
+            writer = outputs[profile]
+            if 'key' in profiles[profile]:
+                row['key'] = str(writer.count + 1)
+            writer.write(row)
+    finally:
+        for writer in outputs.values():
+            writer.close()
+    return {profile: writer.paths if getattr(writer, 'split', False) else writer.path
+            for profile, writer in outputs.items()}
+
+
+def convert_incremental(input_folder, files, output_folder, output_file, engine='soup', workers=1, progress=None,
+                        output=None, report=None):
+    """
+    Converts a folder of XML files into a single CSV file, only parsing files that are new
+    or changed since the last run. Rows are cached in a manifest next to the CSV (see manifest.py)
+    and the CSV is rebuilt from them, files that were deleted drop out of the output
+    :param input_folder: the input folder containing XML files, the manifest keeps the file names relative to it
+    :param files: the sorted MODS XML files of the folder, see collection_files
+    :param output_folder: the output folder to output the CSV
+    :param output_file: the name of the CSV file to save content in
+    :param engine: the extraction engine, see get_engine
+    :param workers: the number of processes to map changed files with
+    :param progress: callable(done, total, filename) called after each changed file, see with_progress
+    :param output: dict of output options for writers.open_writer e.g. output_format, None for plain CSV
+    :param report: the errors.ErrorReport to record failed files in and carry on, None to stop at the first error.
+    Failed files aren't cached, so they are tried again on the next run
+    :return: the detected profile name, see profiles
+    """
+    names = [os.path.relpath(filename, input_folder) for filename in files]
+    output_path = os.path.join(output_folder, output_file)
+
+    manifest = Manifest(manifest_path(output_path))
+    try:
+        # The collection profile comes from the first file, only parse it if it changed
+        first_doc, first_index = None, 0
+        current, _ = manifest.check(names[0], files[0])
+        if current:
+            profile = manifest.profile(names[0])
+        elif report is not None:
+            profile, first_index, first_doc = find_profile(files, engine)
+        else:
+            profile, first_doc = detect_profile(files[0], engine)
+
+        # Cached rows only hold the columns of the profile they were mapped with
+        if manifest.get_meta('profile') != profile:
+            manifest.clear()
+            manifest.set_meta('profile', profile)
+
+        cols = profiles[profile]
+        row_cols = [col for col in cols if col != 'key']
+        checks = [manifest.check(name, filename) for name, filename in zip(names, files)]
+        stale = [i for i, (current, _) in enumerate(checks) if not current]
+
+        failed = set()
+        if first_doc is not None and first_index in stale:
+            if report is not None:
+                row, failure = guarded(map_doc, files[first_index], first_doc, row_cols, engine)
+            else:
+                row, failure = map_doc(files[first_index], first_doc, row_cols, engine), None
+            if failure is None:
+                manifest.put(names[first_index], checks[first_index][1], profile, row)
+            else:
+                report.add(failure)
+                failed.add(names[first_index])
+            stale.remove(first_index)
+
+        n = len(stale)
+        stale_files = [files[i] for i in stale]
+        func = partial(guarded, map_profiled_file) if report is not None else map_profiled_file
+        mapped = file_map(func, workers, stale_files, repeat(row_cols, n), repeat(engine, n))
+        mapped = with_progress(mapped, stale_files, progress)
+        for i, result in zip(stale, mapped):
+            if report is not None:
+                result, failure = result
+                if failure is not None:
+                    report.add(failure)
+                    failed.add(names[i])
+                    continue
+            file_profile, row = result
+            manifest.put(names[i], checks[i][1], file_profile, row)
+
+        # Failed files are dropped like deleted ones, an old row of a file that now fails isn't kept
+        names = [name for name in names if name not in failed]
+        manifest.prune(names)
+        manifest.commit()
+
+        def cached_rows():
+            for i, name in enumerate(names):
+                row = manifest.row(name)
+                if 'key' in cols:
+                    row['key'] = str(i + 1)
+                yield row
+
+        write_rows(cached_rows(), cols, output_path, **(output or {}))
+    finally:
+        manifest.close()
+    return profile
+
+
+def convert_files(files, cols, output_path, engine='soup', streaming=False, workers=1, first_doc=None,
+                  progress=None, output=None, report=None, first_index=0):
+    """
+    Maps each file to a row and saves the rows as a CSV (or another output format) file.
+    Rows are buffered as plain dicts and only written once at the end,
+    or in streaming mode each row is written as soon as its file is mapped
+    :param files: the sorted MODS XML file names
+    :param cols: the column names, in CSV order
+    :param output_path: the path of the CSV file
+    :param engine: the extraction engine, see get_engine
+    :param streaming: whether to write rows as they are mapped, keeping memory flat
+    :param workers: the number of processes to map files with
+    :param first_doc: the already parsed first file from detect_profile (or file first_index from find_profile),
+    None to parse it
+    :param progress: callable(done, total, filename) called after each file, see with_progress
+    :param output: dict of output options for writers.open_writer e.g. output_format, None for plain CSV
+    :param report: the errors.ErrorReport to record failed files in and carry on, None to stop at the first error.
+    The keys of the rows written are numbered without the failed files
+    :param first_index: the position of first_doc's file in files
+    :return: None
+    """
+    rows = map_parsed(files, cols, engine, workers, first_doc, first_index, fail_soft=report is not None)
+    rows = with_progress(rows, files, progress)
+    if report is not None:
+        rows = renumber(report.passed(rows), cols)
+
+    if streaming:
+        write_rows(rows, cols, output_path, **(output or {}))
+    elif output:
+        write_rows(list(rows), cols, output_path, **output)
+    else:
+        save(pd.DataFrame(list(rows), columns=cols), output_path)
 
 
-def convert_to_csv(input_folder, output_folder, output_file):
+def convert_checkpointed(files, cols, output_path, profile, engine='soup', workers=1, progress=None, output=None,
+                         report=None, first_doc=None, first_index=0):
+    """
+    Maps each file to a row like convert_files, storing the rows in a checkpoint (see checkpoint.py) as they
+    come in. A conversion that was stopped carries on from its checkpoint, the output is written from the
+    checkpoint once every file is mapped and comes out the same as if it had run in one go
+    :param files: the sorted MODS XML file names
+    :param cols: the column names, in CSV order
+    :param output_path: the path of the CSV file
+    :param profile: the collection profile, a checkpoint of another profile is started over
+    :param engine: the extraction engine, see get_engine
+    :param workers: the number of processes to map files with
+    :param progress: callable(done, total, filename) called after each file, see with_progress
+    :param output: dict of output options for writers.open_writer e.g. output_format, None for plain CSV
+    :param report: the errors.ErrorReport to record failed files in and carry on, None to stop at the first error.
+    Failures from before the conversion was stopped are recorded again
+    :param first_doc: the already parsed file from detect_profile or find_profile, mapped instead of parsing
+    the file again unless it is in the checkpoint already. None to parse it
+    :param first_index: the position of first_doc's file in files
+    :return: None
+    """
+    checkpoint = Checkpoint(checkpoint_path(output_path), files, profile)
+    try:
+        start = checkpoint.done
+        if report is not None:
+            for failed in checkpoint.failures():
+                report.add(failed)
+
+        mapped = map_parsed(files, cols, engine, workers, first_doc, first_index, report is not None, start)
+        for position, result in enumerate(with_progress(mapped, files, progress, start), start):
+            if report is not None:
+                result, failed = result
+                if failed is not None:
+                    report.add(failed)
+                    checkpoint.add(position, failure=failed)
+                    continue
+            checkpoint.add(position, result)
+
+        # Keys are numbered again in case files failed
+        write_rows(renumber(checkpoint.rows(), cols), cols, output_path, **(output or {}))
+    except BaseException:
+        checkpoint.close()
+        raise
+    checkpoint.remove()
+
+
+def convert_newspapers_to_csv(files, output_folder, output_file, engine='soup', streaming=False, workers=1,
+                              progress=None):
+    convert_files(files, news_col_names, os.path.join(output_folder, output_file), engine, streaming, workers,
+                  progress=progress)
+
+
+def convert_to_csv(input_folder, output_folder, output_file, engine='soup', streaming=False, workers=1,
+                   split_profiles=False, incremental=False, progress=None, profile_columns=False, files=None,
+                   output_format='csv', compression=None, part_rows=None, part_bytes=None, errors=None,
+                   quarantine=None, resume=False):
     """
     Converts a folder of XML files into a single CSV file
     :param input_folder: the input folder containing XML files
     :param output_folder: the output folder to output the CSV
     :param output_file: the name of the CSV file to save content in
-    :return: None
+    :param engine: the extraction engine, 'soup' (bs4 mappings) or 'lxml' (single pass)
+    :param streaming: whether to write each row to the CSV as soon as it is mapped
+    :param workers: the number of processes to map files with, rows keep the sorted file order
+    :param split_profiles: whether to classify each file on its own and write one CSV per profile,
+    see convert_mixed_to_csv
+    :param incremental: whether to only parse new or changed files, see convert_incremental
+    :param progress: callable(done, total, filename) called after each file is mapped.
+    It can raise Cancelled to stop, in which case nothing is saved unless streaming or split_profiles
+    :param profile_columns: whether to time every mapping call and report per column (see profiler.py).
+    True prints the report at the end, a path dumps it there (.json or CSV). Needs workers=1
+    :param files: the sorted MODS XML files of the folder, e.g. a listing from get_mods_files that was
+    already shown to the user, None to find them
+    :param output_format: 'csv', 'parquet' or 'feather' (needs pyarrow), or 'sqlite', see writers.formats.
+    output_file is used as given, whatever its extension
+    :param compression: 'gzip' or 'zstd' (needs Python 3.14 or zstandard) to compress CSV output as it is written,
+    adding .gz or .zst to the file name
+    :param part_rows: split CSV output into numbered parts of at most this many rows (see writers.CsvWriter)
+    :param part_bytes: split CSV output into numbered parts of at most this many uncompressed bytes
+    :param errors: the path of an error report (CSV, or JSON lines for .jsonl) to convert fail-soft: files that
+    can't be read, parsed or mapped are left out and recorded there (see errors.py) instead of stopping the conversion
+    :param quarantine: the folder to copy the failed files to, needs errors
+    :param resume: whether to keep a checkpoint next to the output file while converting, and carry on from
+    the checkpoint of an earlier run that was stopped (see convert_checkpointed). It is deleted once the output
+    is written. A checkpoint made for a different list of files is started over
+    :return: the detected profile name (see profiles), or with split_profiles the dict from convert_mixed_to_csv
     """
-    # updated for **Rev 18.5 of the Master Metadata Sheet**
-
-    col_names = [
-        'key', 'imageLink', 'PID', 'Filename', 'Directory', 'child_key', 'Title', 'AlternativeTitle', 'Creator1_Given',
-        'Creator1_Family', 'CorporateCreator', 'Contributor1_Given', 'Contributor1_Family', 'Contributor2_Given',
-        'Contributor2_Family', 'CorporateContributor',
-        'Publisher_Original', 'DateCreated', 'Description', 'Extent', 'Subject1_Topic', 'Subject2_Topic',
-        'Subject3_Topic',
-        'Subject4_Topic', 'Subject5_Topic', 'Subject_Geographic', 'Coordinates', 'Subject1_Given', 'Subject1_Family',
-        'Subject2_Given', 'Subject2_Family', 'Subject3_Given', 'Subject3_Family', 'CorporateSubject_1',
-        'CorporateSubject_2', 'DateRange', 'Genre', 'GenreAuthority', 'Type', 'internetMediaType', 'Language1',
-        'Language2', 'Notes', 'AccessIdentifier', 'LocalIdentifier', 'ISBN', 'Classification', 'URI', 'Source',
-        'Rights',
-        'CreativeCommons_URI', 'RightsStatement', 'relatedItem_Title', 'relatedItem_PID', 'recordCreationDate',
-        'recordOrigin'
-    ]
+    if split_profiles and incremental:
+        raise ValueError('split_profiles and incremental can not be combined')
+    if output_format not in formats:
+        raise ValueError('Unknown output format %s, expected one of %s' % (output_format, ', '.join(formats)))
+    if compression is not None and compression not in compressions:
+        raise ValueError('Unknown compression %s, expected one of %s' % (compression, ', '.join(compressions)))
+    if output_format != 'csv' and (compression is not None or part_rows is not None or part_bytes is not None):
+        raise ValueError('compression, part_rows and part_bytes are only for csv output')
+    if part_rows is not None and part_rows < 1 or part_bytes is not None and part_bytes < 1:
+        raise ValueError('part_rows and part_bytes must be positive')
+    if quarantine is not None and errors is None:
+        raise ValueError('quarantine needs an errors report')
+    if resume and (split_profiles or incremental):
+        raise ValueError('resume can not be combined with split_profiles or incremental')
+
+    # Options for writers.open_writer, plain CSV is written by save unless streaming
+    output = {name: value for name, value in [('compression', compression), ('part_rows', part_rows),
+                                              ('part_bytes', part_bytes)] if value is not None}
+    if output_format != 'csv':
+        output['output_format'] = output_format
+
+    profiler = None
+    if profile_columns:
+        if workers > 1:
+            raise ValueError('profile_columns needs workers=1, the columns are mapped in this process')
+        profiler = ColumnProfiler()
+        engine = profiler.wrap(get_engine(engine))
 
     # Sort the file names in order to make CSV more organized and also easier
     # for unit tests
-    files = get_mods_files(input_folder)
-
-    # Check newspaper
-    if is_newspaper_issue(files[0]):
-        convert_newspapers_to_csv(files, output_folder, output_file)
-        return  # Don't continue
-
-    # Create data frame
-    df = pd.DataFrame(columns=col_names)
-    df.append(pd.Series(dtype=float), ignore_index=True)
-
-    # Used to keep track of row number in data frame
-    i = 0
-    for filename in files:
-        # Read file contents
-        with open(filename, "r", encoding="utf8") as infile:
-            contents = infile.read()
-
-        # Load contents into beautifulsoup to parse xml
-        soup = BeautifulSoup(contents, 'xml')
-
-        # Set custom attrs
-        soup.i = i
-        soup.filename = filename
-
-        # Set cols
-        for col in col_names:
-            if col not in mappings:
-                continue
-            val = mappings[col](soup)
-            if val:
-                df.at[i, col] = val
-        i += 1
-        reset()  # Reset mappings for next file
-
-    save(df, os.path.join(output_folder, output_file))
+    files = collection_files(input_folder, files)
+
+    report = ErrorReport(errors, quarantine, input_folder) if errors is not None else None
+    try:
+        if split_profiles:
+            result = convert_mixed_to_csv(files, output_folder, output_file, engine, workers, progress, output, report)
+        elif incremental:
+            result = convert_incremental(input_folder, files, output_folder, output_file, engine, workers, progress,
+                                         output, report)
+        else:
+            # Check newspaper, the first file is only parsed once
+            if report is not None:
+                result, first_index, first_doc = find_profile(files, engine)
+            else:
+                (result, first_doc), first_index = detect_profile(files[0], engine), 0
+
+            output_path = os.path.join(output_folder, output_file)
+            if resume:
+                convert_checkpointed(files, profiles[result], output_path, result, engine, workers, progress, output,
+                                     report, first_doc, first_index)
+            else:
+                convert_files(files, profiles[result], output_path, engine, streaming, workers, first_doc, progress,
+                              output, report, first_index)
+    finally:
+        if report is not None:
+            report.close()
+
+    if profiler is not None:
+        if isinstance(profile_columns, str):
+            profiler.dump(profile_columns)
+        else:
+            profiler.print_report()
+    return result
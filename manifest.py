@@ -0,0 +1,141 @@
+"""
+Manifest of converted files for incremental conversion.
+
+The manifest is a SQLite file next to the output CSV. It keeps each input file's
+size, mtime, content hash, profile and mapped row, so unchanged files don't have
+to be parsed again on the next run.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+
+def manifest_path(output_path):
+    """
+    Gets the manifest path for an output CSV
+    :param output_path: the output CSV path e.g. out/collection.csv
+    :return: the manifest path e.g. out/collection.manifest.sqlite
+    """
+    return os.path.splitext(output_path)[0] + '.manifest.sqlite'
+
+
+def file_hash(filename):
+    """
+    Hashes the contents of a file
+    :param filename: the file name
+    :return: the hex digest str
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Manifest(object):
+    """
+    SQLite cache of converted files, keyed by path relative to the input folder.
+    Rows are stored without the key column since it depends on the row's place in the CSV
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files '
+            '(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT, profile TEXT, row TEXT)'
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        # Only the small fingerprint columns are kept in memory, rows are read when needed
+        self.entries = {
+            path: (size, mtime_ns, _hash, profile)
+            for path, size, mtime_ns, _hash, profile in
+            self.conn.execute('SELECT path, size, mtime_ns, hash, profile FROM files')
+        }
+
+    def check(self, path, filename):
+        """
+        Checks whether a file is unchanged since it was last converted.
+        Size and mtime are compared first, the content is only hashed when they differ
+        :param path: the manifest path of the file
+        :param filename: the file name on disk
+        :return: tuple of whether the cached row is current and the (size, mtime_ns, hash) fingerprint
+        """
+        stat = os.stat(filename)
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            return True, entry[:3]
+
+        _hash = file_hash(filename)
+        fingerprint = (stat.st_size, stat.st_mtime_ns, _hash)
+        if entry is not None and entry[2] == _hash:
+            # Touched but not changed, remember the new mtime
+            self.conn.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                              (stat.st_size, stat.st_mtime_ns, path))
+            self.entries[path] = fingerprint + (entry[3],)
+            return True, fingerprint
+        return False, fingerprint
+
+    def profile(self, path):
+        """
+        Gets the profile of a converted file
+        :param path: the manifest path of the file
+        :return: the profile name, None if not in the manifest
+        """
+        entry = self.entries.get(path)
+        return entry[3] if entry is not None else None
+
+    def row(self, path):
+        """
+        Gets the cached row of a converted file
+        :param path: the manifest path of the file
+        :return: the row dict
+        """
+        (row,) = self.conn.execute('SELECT row FROM files WHERE path = ?', (path,)).fetchone()
+        return json.loads(row)
+
+    def put(self, path, fingerprint, profile, row):
+        """
+        Stores a converted file
+        :param path: the manifest path of the file
+        :param fingerprint: the (size, mtime_ns, hash) from check
+        :param profile: the file's own profile
+        :param row: the row dict, without the key
+        :return: None
+        """
+        self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                          (path,) + tuple(fingerprint) + (profile, json.dumps(row)))
+        self.entries[path] = tuple(fingerprint) + (profile,)
+
+    def prune(self, paths):
+        """
+        Drops files that are no longer in the input folder
+        :param paths: the manifest paths of the current files
+        :return: the number of files dropped
+        """
+        deleted = set(self.entries) - set(paths)
+        self.conn.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in deleted])
+        for path in deleted:
+            del self.entries[path]
+        return len(deleted)
+
+    def get_meta(self, name):
+        result = self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return result[0] if result else None
+
+    def set_meta(self, name, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, value))
+
+    def clear(self):
+        """
+        Drops every cached file, e.g. when the collection profile changed
+        :return: None
+        """
+        self.conn.execute('DELETE FROM files')
+        self.entries.clear()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
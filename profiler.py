@@ -0,0 +1,137 @@
+"""
+Per column profiler for the mapping functions.
+
+Times every mapping call made while converting and reports, per column, the number
+of calls, total time and percentiles. Parsing is reported as the <parse> column.
+"""
+import csv
+import json
+import random
+import sys
+import time
+from functools import partial
+
+SAMPLES = 4096  # Timings kept per column for the percentiles
+
+
+class ColumnStats(object):
+    """
+    Timings of one column, percentiles come from a fixed size random sample
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < SAMPLES:
+            self.samples.append(seconds)
+        else:
+            # Reservoir sampling keeps every call equally likely to be in the sample
+            j = self.rng.randrange(self.count)
+            if j < SAMPLES:
+                self.samples[j] = seconds
+
+    def percentile(self, p):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0.0
+
+
+class ColumnProfiler(object):
+    """
+    Collects the timings, see wrap for attaching it to an extraction engine
+    """
+
+    def __init__(self):
+        self.rng = random.Random(0)
+        self.columns = {}
+
+    def record(self, col, seconds):
+        """
+        Records the time of one mapping call
+        :param col: the column name
+        :param seconds: the time taken
+        :return: None
+        """
+        stats = self.columns.get(col)
+        if stats is None:
+            stats = self.columns[col] = ColumnStats(self.rng)
+        stats.add(seconds)
+
+    def call(self, col, func, *args):
+        """
+        Calls func and records its time under col
+        :return: what func returned
+        """
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.record(col, time.perf_counter() - start)
+
+    def wrap(self, engine):
+        """
+        Makes a profiled copy of an extraction engine (see logic.Engine).
+        The engine's row function must take a profiler keyword argument
+        :param engine: the engine
+        :return: the profiled engine
+        """
+        return engine._replace(
+            parse=partial(self.call, '<parse>', engine.parse),
+            row=partial(engine.row, profiler=self)
+        )
+
+    def report(self):
+        """
+        Aggregates the timings, slowest columns first
+        :return: list of dicts with column, calls, total_s, share, mean_us, p50_us, p99_us and max_us
+        """
+        grand_total = sum(stats.total for stats in self.columns.values()) or 1.0
+        rows = []
+        for col, stats in self.columns.items():
+            rows.append({
+                'column': col,
+                'calls': stats.count,
+                'total_s': stats.total,
+                'share': stats.total / grand_total,
+                'mean_us': stats.total / stats.count * 1e6,
+                'p50_us': stats.percentile(50) * 1e6,
+                'p99_us': stats.percentile(99) * 1e6,
+                'max_us': stats.max * 1e6,
+            })
+        return sorted(rows, key=lambda row: row['total_s'], reverse=True)
+
+    def print_report(self, out=None):
+        """
+        Prints the report as a table
+        :param out: the stream to print to, None for stdout
+        :return: None
+        """
+        out = out or sys.stdout
+        print('%-22s %9s %10s %7s %10s %10s %10s %10s' % (
+            'column', 'calls', 'total s', 'share', 'mean us', 'p50 us', 'p99 us', 'max us'), file=out)
+        for row in self.report():
+            print('%-22s %9d %10.3f %6.1f%% %10.1f %10.1f %10.1f %10.1f' % (
+                row['column'], row['calls'], row['total_s'], row['share'] * 100, row['mean_us'], row['p50_us'],
+                row['p99_us'], row['max_us']), file=out)
+
+    def dump(self, path):
+        """
+        Writes the report to a .json file, or a CSV file for any other extension
+        :param path: the report path
+        :return: None
+        """
+        report = self.report()
+        with open(path, 'w', encoding='utf-8', newline='') as outfile:
+            if path.endswith('.json'):
+                json.dump(report, outfile, indent=2)
+            else:
+                writer = csv.DictWriter(outfile, fieldnames=list(report[0]) if report else ['column'])
+                writer.writeheader()
+                writer.writerows(report)
@@ -0,0 +1,59 @@
+"""
+Read ahead of MODS XML files.
+
+Reads upcoming files on a thread pool while the current one is parsed, so the
+CPU doesn't sit idle waiting on slow (e.g. network mounted) storage. At most
+depth files are read ahead, which caps the memory used. Large files are memory
+mapped instead of read, the parsers take the bytes straight from the mapping.
+"""
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+READ_THREADS = 4  # Files read at once
+PREFETCH_DEPTH = 16  # Files read ahead of the one being parsed
+MMAP_SIZE = 1 << 20  # Files this big or bigger are memory mapped
+
+
+def open_input(filename):
+    """
+    Gets the contents of a MODS XML file for parsing. Large files (see MMAP_SIZE) are memory mapped
+    and the kernel is asked to start reading them in, smaller ones are read
+    :param filename: the file name
+    :return: the contents as bytes, or a read only mmap (which is also a file object)
+    """
+    with open(filename, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if size < MMAP_SIZE or size == 0:
+            return infile.read()
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, 'madvise'):
+        mapped.madvise(mmap.MADV_WILLNEED)
+    return mapped
+
+
+def prefetch(files, threads=READ_THREADS, depth=PREFETCH_DEPTH):
+    """
+    Reads files ahead on a thread pool. Closing the generator cancels the reads still queued
+    :param files: iterable of file names
+    :param threads: the number of reader threads
+    :param depth: the most files read ahead of the one being used
+    :return: generator of the file contents from open_input, in the order of files. None for files that
+    couldn't be read, the caller reads those itself so the error comes up where the file is used
+    """
+    files = iter(files)
+    executor = ThreadPoolExecutor(max_workers=threads)
+    queue = deque(executor.submit(open_input, filename) for filename in islice(files, depth))
+    try:
+        while queue:
+            try:
+                contents = queue.popleft().result()
+            except OSError:
+                contents = None
+            # Keep the queue full while the caller works on this file
+            queue.extend(executor.submit(open_input, filename) for filename in islice(files, 1))
+            yield contents
+    finally:
+        executor.shutdown(cancel_futures=True)
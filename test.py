@@ -1,7 +1,34 @@
+import asyncio
+import csv
+import gzip
+import json
+import mmap
 import os
+import re
+import shutil
+import sqlite3
+import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from io import StringIO
+from unittest import mock
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+import aio
+import extractor
+import logic
+from dates import normalize_date
+from errors import ErrorReport, MappingError, read_report
 from logic import convert_to_csv, convert_date
+from mappings import compile_spec, indexed, load_soup, mappings
+import xmltocsv
+import benchmark
+import reader
 
 
 def get_content(file1, file2):
@@ -15,6 +42,42 @@ def get_content(file1, file2):
         return [line for line in f1], [line for line in f2]
 
 
+def assert_matches_fixtures(test, **kwargs):
+    """
+    Converts every test collection and checks each CSV against its manually prepared output
+    :param test: the TestCase
+    :param kwargs: keyword arguments for convert_to_csv e.g. engine='lxml'
+    :return: None
+    """
+    for collection in ['arms_oralHistories', 'klhs_photographs', 'news_issues', 'klhs_shino',
+                       'osoyoos_transportation']:
+        with test.subTest(collection=collection):
+            output_file = 'test_%s.csv' % collection
+            convert_to_csv('test/input/' + collection, 'test/test_output', output_file, **kwargs)
+
+            file1_content, file2_content = get_content('test/test_output/' + output_file,
+                                                       'test/output/%s.csv' % collection)
+            test.assertListEqual(file1_content, file2_content)
+
+
+@contextmanager
+def counted_parses(engine='soup'):
+    """
+    Counts the files an engine parses in this process, worker processes aren't counted
+    :param engine: the extraction engine name, see logic.engines
+    :return: context manager of the list of parsed file names (without their folder), in the order they are parsed
+    """
+    parsed = []
+    _engine = logic.engines[engine]
+
+    def parse(filename, *args):
+        parsed.append(os.path.basename(filename))
+        return _engine.parse(filename, *args)
+
+    with mock.patch.dict(logic.engines, {engine: _engine._replace(parse=parse)}):
+        yield parsed
+
+
 """
 Test class for the convert_to_csv method
 """
@@ -87,6 +150,821 @@ class TestConversionMethod(unittest.TestCase):
         self.assertListEqual(file1_content, file2_content)
 
 
+"""
+Test class for the convert_to_csv method using the single pass lxml engine
+"""
+
+
+class TestLxmlEngine(unittest.TestCase):
+    def test_conversion(self):
+        assert_matches_fixtures(self, engine='lxml')
+
+
+"""
+Test class for the convert_to_csv method in streaming mode
+"""
+
+
+class TestStreamingMode(unittest.TestCase):
+    def test_conversion(self):
+        assert_matches_fixtures(self, streaming=True)
+
+
+"""
+Test class for the convert_to_csv method with a process pool
+"""
+
+
+class TestParallelMode(unittest.TestCase):
+    def test_conversion(self):
+        assert_matches_fixtures(self, workers=2)
+
+
+"""
+Test class for the per document mapping stores
+"""
+
+
+class TestMappingStores(unittest.TestCase):
+    def test_interleaved_documents(self):
+        filenames = ['test/input/klhs_photographs/klhs_1.xml', 'test/input/klhs_photographs/klhs_2.xml']
+        soups = []
+        for i, filename in enumerate(filenames):
+            with open(filename, 'r', encoding='utf8') as infile:
+                soups.append(load_soup(infile.read(), i, filename))
+
+        # Map both documents column by column without any reset in between
+        for col in ['Subject1_Topic', 'Subject1_Given', 'Creator1_Given', 'Language1']:
+            self.assertEqual(
+                [mappings[col](soup) for soup in soups],
+                [mappings[col](soup) for soup in reversed(soups)][::-1]
+            )
+        self.assertEqual(mappings['Subject1_Topic'](soups[0]), 'Steamboats')
+        self.assertEqual(mappings['Subject1_Topic'](soups[1]), 'Portraits')
+        self.assertIsNone(mappings['Creator1_Given'](soups[1]))
+
+
+"""
+Test class for the per document element index
+"""
+
+
+class TestElementIndex(unittest.TestCase):
+    def test_matches_find_all(self):
+        for filename in logic.get_mods_files('test/input/klhs_photographs') + \
+                logic.get_mods_files('test/input/news_issues'):
+            with open(filename, 'r', encoding='utf8') as infile:
+                soup = load_soup(infile.read(), 0, filename)
+            for field, attrs in [('title', None), ('topic', None), ('identifier', {'type': 'local'}),
+                                 ('accessCondition', {'displayLabel': 'Rights Statement'}),
+                                 ('dateIssued', {'encoding': 'w3cdtf', 'keyDate': 'yes'}), ('missing', None)]:
+                with self.subTest(filename=filename, field=field, attrs=attrs):
+                    self.assertListEqual(indexed(soup, field, attrs), soup.find_all(field, attrs or {}))
+            self.assertListEqual(indexed(soup, 'name', {'type': 'personal'}, 'subject'),
+                                 soup.select('subject > name[type=personal]'))
+
+
+"""
+Test class for compiling a column spec
+"""
+
+
+class TestColumnSpec(unittest.TestCase):
+    def test_new_rules(self):
+        filename = 'test/input/klhs_photographs/klhs_1.xml'
+        with open(filename, 'r', encoding='utf8') as infile:
+            soup = load_soup(infile.read(), 0, filename)
+        compiled = compile_spec([
+            {'columns': {'Person%d': {'find': 'namePart', 'attrs': {'type': 'family'}}}, 'find': 'name',
+             'attrs': {'type': 'personal'}, 'count': 6},
+            {'column': 'DateEncoding', 'find': 'dateIssued', 'attrs': {'keyDate': 'yes'}, 'attribute': 'encoding'},
+            {'column': 'LastTopic', 'find': 'topic', 'occurrence': -1},
+            {'column': 'Missing', 'find': 'missing', 'default': 'n/a'}
+        ])
+        self.assertDictEqual({col: mapping(soup) for col, mapping in compiled.items()}, {
+            'Person1': 'Jerome', 'Person2': 'Sample', 'Person3': 'Reagan', 'Person4': 'Sample', 'Person5': 'Sample',
+            'Person6': None, 'DateEncoding': 'w3cdtf', 'LastTopic': 'Sample', 'Missing': 'n/a'
+        })
+        # The group is gathered once into a single store
+        self.assertListEqual(list(soup.stores), ['Person%d'])
+
+    def test_spec_columns_in_both_engines(self):
+        self.assertListEqual(list(extractor.mappings), list(mappings))
+        for filename in logic.get_mods_files('test/input'):
+            with self.subTest(filename=filename):
+                soup = logic.parse_soup(filename, 0)
+                self.assertDictEqual(extractor.build_row(extractor.load(filename, 0)),
+                                     {col: mapping(soup) for col, mapping in mappings.items()})
+
+    def test_new_rules_in_lxml_engine(self):
+        filename = 'test/input/klhs_photographs/klhs_1.xml'
+        rules = [
+            {'columns': {'Person%d': {'find': 'namePart', 'attrs': {'type': 'family'}}}, 'find': 'name',
+             'attrs': {'type': 'personal'}, 'count': 6},
+            {'column': 'DateEncoding', 'find': 'dateIssued', 'attrs': {'keyDate': 'yes'}, 'attribute': 'encoding'},
+            {'column': 'LastTopic', 'find': 'topic', 'occurrence': -1},
+            {'column': 'Missing', 'find': 'missing', 'default': 'n/a'},
+            {'column': 'Role', 'select': 'name[type=personal] > role > roleTerm'}
+        ]
+        soup, doc = logic.parse_soup(filename, 0), extractor.load(filename, 0)
+        self.assertDictEqual({col: mapping(doc) for col, mapping in extractor.compile_spec(rules).items()},
+                             {col: mapping(soup) for col, mapping in compile_spec(rules).items()})
+        with self.assertRaises(ValueError):
+            extractor.compile_spec([{'column': 'Role', 'select': 'name roleTerm'}])
+
+
+"""
+Test class for memory mapped input
+"""
+
+
+class TestMappedInput(unittest.TestCase):
+    def test_conversion(self):
+        with mock.patch('reader.MMAP_SIZE', 0):
+            self.assertIsInstance(reader.open_input('test/input/news_issues/doh_351.xml'), mmap.mmap)
+            for engine in logic.engines:
+                with self.subTest(engine=engine):
+                    assert_matches_fixtures(self, engine=engine)
+
+
+"""
+Test class for the Parquet and Feather output formats
+"""
+
+
+@unittest.skipIf(pyarrow is None, 'needs pyarrow')
+class TestColumnarOutput(unittest.TestCase):
+    def read(self, path, output_format):
+        import pyarrow.feather
+        import pyarrow.parquet
+        if output_format == 'parquet':
+            return pyarrow.parquet.read_table(path)
+        return pyarrow.feather.read_table(path)
+
+    def test_conversion(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with open('test/output/klhs_photographs.csv', 'r', encoding='utf-8', newline='') as infile:
+            expected = [{col: (int(value) if col == 'key' else value) if value != '' else None
+                         for col, value in row.items()} for row in csv.DictReader(infile)]
+
+        # Small batches so the file is written in several row groups
+        with mock.patch('writers.BATCH_ROWS', 3):
+            for output_format in ['parquet', 'feather']:
+                for streaming in [False, True]:
+                    with self.subTest(output_format=output_format, streaming=streaming):
+                        path = os.path.join(folder, 'out.' + output_format)
+                        convert_to_csv('test/input/klhs_photographs', folder, 'out.' + output_format,
+                                       streaming=streaming, output_format=output_format)
+                        table = self.read(path, output_format)
+                        self.assertListEqual(table.column_names, logic.col_names)
+                        self.assertEqual(str(table.schema.field('key').type), 'int64')
+                        self.assertListEqual(table.to_pylist(), expected)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            convert_to_csv('test/input/klhs_photographs', 'test/test_output', 'out.xlsx', output_format='xlsx')
+
+
+"""
+Test class for the SQLite output format
+"""
+
+
+class TestSqliteOutput(unittest.TestCase):
+    def test_conversion(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        for collection, indexes in [('klhs_photographs', ['records_DateCreated', 'records_LocalIdentifier',
+                                                          'records_PID']),
+                                    ('news_issues', ['records_DateCreated'])]:
+            with open('test/output/%s.csv' % collection, 'r', encoding='utf-8', newline='') as infile:
+                expected = [tuple((int(value) if col == 'key' else value) if value != '' else None
+                                  for col, value in row.items()) for row in csv.DictReader(infile)]
+            path = os.path.join(folder, collection + '.sqlite')
+
+            # The second run replaces the rows of the first
+            for streaming in [False, True]:
+                with self.subTest(collection=collection, streaming=streaming):
+                    convert_to_csv('test/input/' + collection, folder, collection + '.sqlite', streaming=streaming,
+                                   output_format='sqlite')
+                    conn = sqlite3.connect(path)
+                    self.assertListEqual(conn.execute('SELECT * FROM records ORDER BY key').fetchall(), expected)
+                    self.assertListEqual(sorted(index for _, index, *_ in conn.execute('PRAGMA index_list(records)')),
+                                         indexes)
+                    conn.close()
+
+
+"""
+Test class for compressed CSV output split into parts
+"""
+
+
+class TestOutputParts(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        with open('test/output/arms_oralHistories.csv', 'r', encoding='utf-8', newline='') as infile:
+            self.lines = infile.read().splitlines(keepends=True)
+
+    def convert(self, **kwargs):
+        convert_to_csv('test/input/arms_oralHistories', self.folder, 'out.csv', **kwargs)
+        return sorted(os.listdir(self.folder))
+
+    def test_parts(self):
+        for streaming in [False, True]:
+            with self.subTest(streaming=streaming):
+                self.assertListEqual(self.convert(part_rows=3, streaming=streaming),
+                                     ['out_part0001.csv', 'out_part0002.csv'])
+                parts = []
+                for name in ['out_part0001.csv', 'out_part0002.csv']:
+                    with open(os.path.join(self.folder, name), 'r', encoding='utf-8', newline='') as infile:
+                        parts.append(infile.read().splitlines(keepends=True))
+                self.assertListEqual([part[0] for part in parts], [self.lines[0]] * 2)
+                self.assertListEqual(parts[0] + parts[1][1:], self.lines)
+                self.assertEqual(len(parts[0]), 4)
+
+        # Each part holds at least one row and stays within the size unless a single row is bigger
+        self.assertEqual(len(self.convert(part_bytes=1)), len(self.lines) - 1)
+        # Parts left over from the bigger run are removed
+        self.assertListEqual(self.convert(part_bytes=1 << 20), ['out_part0001.csv'])
+
+    def test_gzip(self):
+        self.assertListEqual(self.convert(compression='gzip'), ['out.csv.gz'])
+        path = os.path.join(self.folder, 'out.csv.gz')
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as infile:
+            self.assertListEqual(infile.read().splitlines(keepends=True), self.lines)
+
+        # Re-runs write the same bytes
+        with open(path, 'rb') as infile:
+            first = infile.read()
+        self.convert(compression='gzip', streaming=True)
+        with open(path, 'rb') as infile:
+            self.assertEqual(infile.read(), first)
+
+    def test_invalid(self):
+        for kwargs in [{'compression': 'rar'}, {'part_rows': 0}, {'output_format': 'parquet', 'part_rows': 10}]:
+            with self.subTest(**kwargs):
+                with self.assertRaises(ValueError):
+                    self.convert(**kwargs)
+
+
+"""
+Test class for finding the MODS XML files of a folder
+"""
+
+
+class TestFileDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        for name in ['b_1.xml', 'a_1.xml', 'a_1.jpg', '.hidden.xml', 'sub/a_2.xml', 'sub/deeper/a_3.xml',
+                     'drafts/a_4.xml', '.git/a_5.xml']:
+            path = os.path.join(self.folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    def found(self, **kwargs):
+        return [os.path.relpath(filename, self.folder).replace(os.sep, '/')
+                for filename in logic.get_mods_files(self.folder, **kwargs)]
+
+    def test_discovery(self):
+        self.assertListEqual(self.found(), ['a_1.xml', 'b_1.xml', 'drafts/a_4.xml', 'sub/a_2.xml',
+                                            'sub/deeper/a_3.xml'])
+        self.assertListEqual(self.found(max_depth=1), ['a_1.xml', 'b_1.xml', 'drafts/a_4.xml', 'sub/a_2.xml'])
+        self.assertListEqual(self.found(exclude=['drafts', 'b_*']), ['a_1.xml', 'sub/a_2.xml', 'sub/deeper/a_3.xml'])
+        self.assertListEqual(self.found(exclude=['sub/deeper/*']), ['a_1.xml', 'b_1.xml', 'drafts/a_4.xml',
+                                                                    'sub/a_2.xml'])
+        self.assertListEqual(self.found(include=['*.jpg', 'b_*.xml']), ['a_1.jpg', 'b_1.xml'])
+        self.assertCountEqual(logic.iter_mods_files(self.folder), logic.get_mods_files(self.folder))
+        for include in [(), None]:
+            with self.subTest(include=include):
+                with self.assertRaises(ValueError):
+                    self.found(include=include)
+
+    def test_listing_reused(self):
+        files = logic.get_mods_files('test/input/klhs_photographs')
+        with mock.patch('logic.get_mods_files', side_effect=AssertionError('walked again')):
+            convert_to_csv('test/input/klhs_photographs', 'test/test_output', 'test_klhs_photographs.csv',
+                           files=files)
+        file1_content, file2_content = get_content('test/test_output/test_klhs_photographs.csv',
+                                                   'test/output/klhs_photographs.csv')
+        self.assertListEqual(file1_content, file2_content)
+
+    def test_no_files(self):
+        errors = os.path.join(self.folder, 'errors.csv')
+        for kwargs in [{}, {'split_profiles': True}, {'incremental': True}, {'errors': errors}]:
+            with self.subTest(**kwargs):
+                with self.assertRaises(ValueError):
+                    convert_to_csv(self.folder, self.folder, 'out.csv', files=[], **kwargs)
+        # The files are checked before anything is written
+        self.assertFalse(os.path.exists(errors))
+        with self.assertRaises(ValueError):
+            asyncio.run(aio.aconvert(self.folder, files=[]).__anext__())
+
+
+"""
+Test class for reading files ahead
+"""
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_order_and_depth(self):
+        files = ['file%d.xml' % x for x in range(100)]
+        read = mock.Mock(side_effect=lambda filename: filename.encode())
+        with mock.patch('reader.open_input', read):
+            self.assertListEqual(list(reader.prefetch(files, threads=3, depth=5)), [f.encode() for f in files])
+
+            read.reset_mock()
+            contents = reader.prefetch(files, threads=3, depth=5)
+            self.assertEqual(next(contents), b'file0.xml')
+            self.assertEqual(next(contents), b'file1.xml')
+            contents.close()
+            # Never more than depth files read ahead of the one being used
+            self.assertLessEqual(read.call_count, 2 + 5)
+
+
+"""
+Test class for collection profile detection
+"""
+
+
+class TestProfileDetection(unittest.TestCase):
+    def test_each_file_parsed_once(self):
+        for engine in logic.engines:
+            for collection, profile in [('news_issues', 'newspaper'), ('klhs_photographs', 'default')]:
+                with self.subTest(engine=engine, collection=collection):
+                    with counted_parses(engine) as parsed:
+                        result = convert_to_csv('test/input/' + collection, 'test/test_output',
+                                                'test_%s.csv' % collection, engine=engine)
+
+                    self.assertEqual(result, profile)
+                    self.assertListEqual(parsed, [os.path.basename(filename) for filename in
+                                                  logic.get_mods_files('test/input/' + collection)])
+
+
+"""
+Test class for converting a folder with newspaper and non-newspaper MODS
+"""
+
+
+class TestMixedFolder(unittest.TestCase):
+    def test_conversion(self):
+        input_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, input_folder)
+        for collection in ['news_issues', 'klhs_photographs']:
+            for filename in logic.get_mods_files('test/input/' + collection):
+                shutil.copy(filename, input_folder)
+
+        for engine in logic.engines:
+            for workers in [1, 2]:
+                with self.subTest(engine=engine, workers=workers):
+                    paths = convert_to_csv(input_folder, input_folder, 'mixed.csv', engine=engine, workers=workers,
+                                           split_profiles=True)
+                    self.assertEqual(paths, {
+                        'default': os.path.join(input_folder, 'mixed_default.csv'),
+                        'newspaper': os.path.join(input_folder, 'mixed_newspaper.csv')
+                    })
+                    for profile, collection in [('default', 'klhs_photographs'), ('newspaper', 'news_issues')]:
+                        file1_content, file2_content = get_content(paths[profile],
+                                                                   'test/output/%s.csv' % collection)
+                        self.assertListEqual(file1_content, file2_content)
+
+        # The files actually written are returned
+        output_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_folder)
+        paths = convert_to_csv(input_folder, output_folder, 'mixed.csv', split_profiles=True, compression='gzip')
+        self.assertEqual(paths['newspaper'], os.path.join(output_folder, 'mixed_newspaper.csv.gz'))
+        paths = convert_to_csv(input_folder, output_folder, 'mixed.csv', split_profiles=True, part_rows=3)
+        self.assertEqual(paths['default'], [os.path.join(output_folder, 'mixed_default_part0001.csv'),
+                                            os.path.join(output_folder, 'mixed_default_part0002.csv')])
+        for part_paths in paths.values():
+            for path in part_paths:
+                self.assertTrue(os.path.exists(path))
+
+
+"""
+Test class for incremental conversion
+"""
+
+
+class TestIncrementalMode(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.input_folder = os.path.join(self.folder, 'klhs_photographs')
+        shutil.copytree('test/input/klhs_photographs', self.input_folder)
+
+    def convert(self):
+        """
+        Converts incrementally, counting the files parsed
+        :return: list of the parsed file names
+        """
+        with counted_parses() as parsed:
+            convert_to_csv(self.input_folder, self.folder, 'out.csv', incremental=True)
+        return parsed
+
+    def assertMatchesFullConversion(self):
+        convert_to_csv(self.input_folder, self.folder, 'full.csv')
+        file1_content, file2_content = get_content(os.path.join(self.folder, 'out.csv'),
+                                                   os.path.join(self.folder, 'full.csv'))
+        self.assertListEqual(file1_content, file2_content)
+
+    def test_conversion(self):
+        self.assertListEqual(self.convert(), ['klhs_1.xml', 'klhs_2.xml', 'klhs_3.xml', 'klhs_4.xml'])
+        file1_content, file2_content = get_content(os.path.join(self.folder, 'out.csv'),
+                                                   'test/output/klhs_photographs.csv')
+        self.assertListEqual(file1_content, file2_content)
+
+        # Nothing changed
+        self.assertListEqual(self.convert(), [])
+        self.assertMatchesFullConversion()
+
+        # Changed and deleted files
+        changed = os.path.join(self.input_folder, 'klhs_3.xml')
+        with open(changed, 'r', encoding='utf8') as infile:
+            contents = infile.read()
+        with open(changed, 'w', encoding='utf8') as outfile:
+            outfile.write(contents.replace('<abstract>', '<abstract>Changed. '))
+        os.remove(os.path.join(self.input_folder, 'klhs_2.xml'))
+
+        self.assertListEqual(self.convert(), ['klhs_3.xml'])
+        self.assertMatchesFullConversion()
+
+
+"""
+Test class for the command line
+"""
+
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_folder)
+
+    def run_main(self, argv):
+        out, err = StringIO(), StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            code = xmltocsv.main(argv)
+        return code, out.getvalue(), err.getvalue()
+
+    def test_batch(self):
+        for jobs in ['1', '2']:
+            with self.subTest(jobs=jobs):
+                code, out, _ = self.run_main(['test/input/klhs_*', 'test/input/news_issues',
+                                              '-o', self.output_folder, '-j', jobs])
+                self.assertEqual(code, 0)
+                self.assertIn('3 of 3 collections converted', out)
+                for collection in ['klhs_photographs', 'klhs_shino', 'news_issues']:
+                    file1_content, file2_content = get_content(
+                        os.path.join(self.output_folder, collection + '.csv'), 'test/output/%s.csv' % collection)
+                    self.assertListEqual(file1_content, file2_content)
+
+    def test_failure(self):
+        empty_folder = os.path.join(self.output_folder, 'empty')
+        os.mkdir(empty_folder)
+        for options in [[], ['--split-profiles']]:
+            with self.subTest(options=options):
+                code, out, err = self.run_main(['test/input/klhs_shino', empty_folder, '-o', self.output_folder] +
+                                               options)
+                self.assertEqual(code, 1)
+                self.assertIn('1 of 2 collections converted', out)
+                self.assertIn('FAILED', err)
+
+    def test_same_folder_names(self):
+        for folder in ['a', 'b']:
+            shutil.copytree('test/input/klhs_shino', os.path.join(self.output_folder, 'in', folder, 'klhs'))
+        code, out, _ = self.run_main([os.path.join(self.output_folder, 'in', '*', 'klhs'),
+                                      '-o', self.output_folder, '-j', '2'])
+        self.assertEqual(code, 0)
+        for name in ['a_klhs', 'b_klhs']:
+            file1_content, file2_content = get_content(os.path.join(self.output_folder, name + '.csv'),
+                                                       'test/output/klhs_shino.csv')
+            self.assertListEqual(file1_content, file2_content)
+
+        # Names that still clash are refused rather than overwriting each other
+        clashing = [os.path.join(self.output_folder, 'in', 'a_b', 'klhs'),
+                    os.path.join(self.output_folder, 'in', 'a', 'b', 'klhs')]
+        for folder in clashing:
+            shutil.copytree('test/input/klhs_shino', folder)
+        code, _, err = self.run_main(clashing + ['-o', self.output_folder])
+        self.assertEqual(code, 2)
+        self.assertIn('a_b_klhs', err)
+
+    def test_errors(self):
+        input_folder = os.path.join(self.output_folder, 'klhs_photographs')
+        shutil.copytree('test/input/klhs_photographs', input_folder)
+        open(os.path.join(input_folder, 'klhs_5.xml'), 'w').close()
+        code, out, err = self.run_main([input_folder, '-o', self.output_folder, '--errors', 'jsonl',
+                                        '--quarantine', os.path.join(self.output_folder, 'quarantine')])
+        self.assertEqual(code, 0)
+        self.assertIn('1 files of %s failed' % input_folder, err)
+        self.assertEqual(len(read_report(os.path.join(self.output_folder, 'klhs_photographs.errors.jsonl'))), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, 'quarantine', 'klhs_photographs',
+                                                    'klhs_5.xml')))
+
+
+"""
+Test class for progress reporting and cancelling
+"""
+
+
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_folder)
+
+    def test_progress(self):
+        calls = []
+        convert_to_csv('test/input/klhs_photographs', self.output_folder, 'out.csv',
+                       progress=lambda done, total, filename: calls.append((done, total, filename)))
+        files = logic.get_mods_files('test/input/klhs_photographs')
+        self.assertListEqual(calls, [(i + 1, len(files), filename) for i, filename in enumerate(files)])
+
+    def test_cancel(self):
+        def cancel(done, total, filename):
+            if done == 2:
+                raise logic.Cancelled()
+
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                with self.assertRaises(logic.Cancelled):
+                    convert_to_csv('test/input/klhs_photographs', self.output_folder, 'cancelled.csv',
+                                   workers=workers, progress=cancel)
+                self.assertFalse(os.path.exists(os.path.join(self.output_folder, 'cancelled.csv')))
+
+
+"""
+Test class for the synthetic benchmark corpus
+"""
+
+
+class TestSyntheticCorpus(unittest.TestCase):
+    def test_engines_agree(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        for kind in benchmark.kinds:
+            with self.subTest(kind=kind):
+                input_folder = os.path.join(folder, kind)
+                benchmark.generate_corpus(input_folder, 60, kind, seed=1, per_folder=25)
+                self.assertEqual(len(logic.get_mods_files(input_folder)), 60)
+
+                for engine in logic.engines:
+                    convert_to_csv(input_folder, folder, '%s_%s.csv' % (kind, engine), engine=engine)
+                file1_content, file2_content = get_content(os.path.join(folder, kind + '_soup.csv'),
+                                                           os.path.join(folder, kind + '_lxml.csv'))
+                self.assertEqual(len(file1_content), 61)
+                self.assertListEqual(file1_content, file2_content)
+
+
+"""
+Test class for the per column profiler
+"""
+
+
+class TestColumnProfiler(unittest.TestCase):
+    def test_report(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        report_path = os.path.join(folder, 'report.json')
+        convert_to_csv('test/input/klhs_photographs', folder, 'out.csv', profile_columns=report_path)
+
+        with open(report_path, 'r') as infile:
+            report = {row['column']: row for row in json.load(infile)}
+        self.assertEqual(report['<parse>']['calls'], 4)
+        self.assertEqual(report['Title']['calls'], 4)
+        self.assertEqual(set(report), {'<parse>'} | {col for col in logic.col_names if col in mappings})
+        for row in report.values():
+            self.assertLessEqual(row['p50_us'], row['p99_us'])
+            self.assertLessEqual(row['p99_us'], row['max_us'])
+
+        # Same CSV as without profiling
+        file1_content, file2_content = get_content(os.path.join(folder, 'out.csv'), 'test/output/klhs_photographs.csv')
+        self.assertListEqual(file1_content, file2_content)
+
+    def test_print(self):
+        out = StringIO()
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with redirect_stdout(out):
+            convert_to_csv('test/input/news_issues', folder, 'out.csv', engine='lxml', profile_columns=True)
+        self.assertIn('IssueTitle', out.getvalue())
+        self.assertIn('<parse>', out.getvalue())
+
+
+"""
+Test class for fail-soft conversion
+"""
+
+
+class TestFailSoft(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_folder)
+        self.input_folder = os.path.join(self.output_folder, 'klhs_photographs')
+        shutil.copytree('test/input/klhs_photographs', self.input_folder)
+        # A record without a title, which the soup engine can't map, and an empty file that isn't a MODS document
+        with open('test/input/klhs_photographs/klhs_1.xml', 'r', encoding='utf-8-sig') as infile:
+            untitled = re.sub(r'<titleInfo.*?</titleInfo>', '', infile.read(), flags=re.S)
+        with open(os.path.join(self.input_folder, 'klhs_2b.xml'), 'w', encoding='utf-8') as outfile:
+            outfile.write(untitled)
+        open(os.path.join(self.input_folder, 'klhs_3b.xml'), 'w').close()
+
+    def convert(self, errors, **kwargs):
+        output_path = os.path.join(self.output_folder, 'out.csv')
+        convert_to_csv(self.input_folder, self.output_folder, 'out.csv', errors=errors, **kwargs)
+        return output_path
+
+    def test_failed_files_skipped(self):
+        for errors, kwargs in [('errors.csv', {}), ('errors.jsonl', {'streaming': True}),
+                               ('errors.csv', {'workers': 2}), ('errors.csv', {'incremental': True})]:
+            with self.subTest(errors=errors, **kwargs):
+                report_path = os.path.join(self.output_folder, errors)
+                quarantine = os.path.join(self.output_folder, 'quarantine')
+                output_path = self.convert(report_path, quarantine=quarantine, **kwargs)
+
+                file1_content, file2_content = get_content(output_path, 'test/output/klhs_photographs.csv')
+                self.assertListEqual(file1_content, file2_content)
+                report = read_report(report_path)
+                self.assertListEqual([(os.path.basename(failed['filename']), failed['column'], failed['error'])
+                                      for failed in report],
+                                     [('klhs_2b.xml', 'Title', 'AttributeError'),
+                                      ('klhs_3b.xml', '<parse>', 'ValueError')])
+                self.assertIn("'NoneType' object has no attribute", report[0]['traceback'])
+                self.assertListEqual(sorted(os.listdir(quarantine)), ['klhs_2b.xml', 'klhs_3b.xml'])
+                shutil.rmtree(quarantine)
+
+    def test_each_file_parsed_once(self):
+        # The empty file goes first and can't be parsed, so the profile comes from the second file
+        os.rename(os.path.join(self.input_folder, 'klhs_3b.xml'), os.path.join(self.input_folder, 'klhs_0.xml'))
+        for engine in logic.engines:
+            for kwargs in [{}, {'incremental': True}]:
+                with self.subTest(engine=engine, **kwargs):
+                    with counted_parses(engine) as parsed:
+                        convert_to_csv(self.input_folder, self.output_folder, 'out_%s.csv' % engine, engine=engine,
+                                       errors=os.path.join(self.output_folder, 'errors.csv'), **kwargs)
+                    # Only the file that can't be parsed is tried twice, for the profile and for its row
+                    self.assertListEqual(sorted(parsed), ['klhs_0.xml', 'klhs_0.xml', 'klhs_1.xml', 'klhs_2.xml',
+                                                          'klhs_2b.xml', 'klhs_3.xml', 'klhs_4.xml'])
+
+    def test_parse_error(self):
+        report_path = os.path.join(self.output_folder, 'errors.csv')
+        for engine in logic.engines:
+            with self.subTest(engine=engine):
+                self.convert(report_path, engine=engine, split_profiles=True)
+                self.assertIn(('klhs_3b.xml', '<parse>'), [(os.path.basename(failed['filename']), failed['column'])
+                                                           for failed in read_report(report_path)])
+
+    def test_malformed_first_file(self):
+        input_folder = os.path.join(self.output_folder, 'news_issues')
+        shutil.copytree('test/input/news_issues', input_folder)
+        open(os.path.join(input_folder, 'doh_000.xml'), 'w').close()
+        report_path = os.path.join(self.output_folder, 'errors.csv')
+        for engine in logic.engines:
+            for kwargs in [{}, {'incremental': True}]:
+                with self.subTest(engine=engine, **kwargs):
+                    convert_to_csv(input_folder, self.output_folder, 'out.csv', engine=engine, errors=report_path,
+                                   **kwargs)
+                    # The profile comes from the first file that parses, so it is still a newspaper collection
+                    file1_content, file2_content = get_content(os.path.join(self.output_folder, 'out.csv'),
+                                                               'test/output/news_issues.csv')
+                    self.assertListEqual(file1_content, file2_content)
+                    self.assertListEqual([(os.path.basename(failed['filename']), failed['column'])
+                                          for failed in read_report(report_path)], [('doh_000.xml', '<parse>')])
+
+    def test_failed_column(self):
+        # A file name without a number can't be made into a PID
+        filename = os.path.join(self.input_folder, 'klhs.xml')
+        shutil.copy('test/input/klhs_photographs/klhs_1.xml', filename)
+        for engine in logic.engines:
+            with self.subTest(engine=engine):
+                with self.assertRaises(MappingError) as context:
+                    logic.map_file(filename, 0, ['key', 'PID', 'Title'], engine)
+                self.assertEqual(context.exception.column, 'PID')
+                self.assertIsInstance(context.exception.__cause__, IndexError)
+
+    def test_fail_fast(self):
+        with self.assertRaises(MappingError) as context:
+            self.convert(None)
+        self.assertEqual(context.exception.column, 'Title')
+        self.assertIsInstance(context.exception.__cause__, AttributeError)
+
+
+"""
+Test class for resuming a stopped conversion
+"""
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_folder)
+        self.output_path = os.path.join(self.output_folder, 'out.csv')
+
+    def convert(self, stop_after=None, **kwargs):
+        """
+        Converts with a checkpoint, counting the files parsed
+        :return: list of the parsed file names, also when stopped
+        """
+        def progress(done, total, filename):
+            if done == stop_after:
+                raise logic.Cancelled()
+        # Kept on the test, so the files parsed are known when the conversion is stopped too
+        with counted_parses() as self.parsed:
+            convert_to_csv('test/input/news_issues', self.output_folder, 'out.csv', progress=progress, resume=True,
+                           **kwargs)
+        return self.parsed
+
+    def test_resume(self):
+        files = [os.path.basename(filename) for filename in logic.get_mods_files('test/input/news_issues')]
+        checkpoint_file = os.path.join(self.output_folder, 'out.checkpoint.sqlite')
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                # Stopped while reporting the third file, so two files are in the checkpoint
+                with self.assertRaises(logic.Cancelled):
+                    self.convert(stop_after=3, workers=workers)
+                self.assertTrue(os.path.exists(checkpoint_file))
+                if workers == 1:
+                    # The first file is parsed once, for the profile and its row
+                    self.assertListEqual(self.parsed, files[:3])
+
+                parsed = self.convert(workers=workers)
+                if workers == 1:
+                    # Only the profile is detected again, the files in the checkpoint are not mapped again
+                    self.assertListEqual(parsed, files[:1] + files[2:])
+                self.assertFalse(os.path.exists(checkpoint_file))
+                file1_content, file2_content = get_content(self.output_path, 'test/output/news_issues.csv')
+                self.assertListEqual(file1_content, file2_content)
+
+    def test_other_files(self):
+        with self.assertRaises(logic.Cancelled):
+            self.convert(stop_after=2)
+        convert_to_csv('test/input/klhs_photographs', self.output_folder, 'out.csv', resume=True)
+        file1_content, file2_content = get_content(self.output_path, 'test/output/klhs_photographs.csv')
+        self.assertListEqual(file1_content, file2_content)
+
+
+"""
+Test class for the asyncio API
+"""
+
+
+class TestAsyncConvert(unittest.TestCase):
+    collections = ['klhs_photographs', 'klhs_shino', 'news_issues']
+
+    def expected_rows(self, collection):
+        files = logic.get_mods_files('test/input/' + collection)
+        profile, _ = logic.detect_profile(files[0])
+        return list(logic.map_files(files, logic.profiles[profile]))
+
+    def test_concurrent_collections(self):
+        async def collect(collection, executor):
+            return [row async for row in aio.aconvert('test/input/' + collection, executor=executor, depth=2)]
+
+        async def convert_all(executor):
+            return await asyncio.gather(*(collect(collection, executor) for collection in self.collections))
+
+        expected = [self.expected_rows(collection) for collection in self.collections]
+        for executor in [None, ProcessPoolExecutor(max_workers=2)]:
+            with self.subTest(executor=type(executor).__name__):
+                self.assertListEqual(asyncio.run(convert_all(executor)), expected)
+                if executor is not None:
+                    executor.shutdown()
+
+    def test_each_file_parsed_once(self):
+        async def collect(report):
+            return [row async for row in aio.aconvert('test/input/news_issues', report=report)]
+
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        for report in [None, ErrorReport(os.path.join(folder, 'errors.csv'))]:
+            with self.subTest(report=report is not None):
+                with counted_parses() as parsed:
+                    rows = asyncio.run(collect(report))
+                self.assertListEqual(rows, self.expected_rows('news_issues'))
+                # The first file is parsed for the profile and mapped from that document
+                self.assertListEqual(sorted(parsed), [os.path.basename(filename) for filename in
+                                                      logic.get_mods_files('test/input/news_issues')])
+                if report is not None:
+                    report.close()
+
+    def test_backpressure(self):
+        mapped = mock.Mock(side_effect=logic.map_file)
+
+        async def take_one():
+            rows = aio.aconvert('test/input/news_issues', depth=2)
+            row = await rows.__anext__()
+            await asyncio.sleep(0.1)
+            await rows.aclose()
+            return row
+
+        with mock.patch('aio.map_file', mapped):
+            row = asyncio.run(take_one())
+        self.assertEqual(row['key'], '1')
+        # Only the files in flight were mapped while the consumer held on to the first row
+        self.assertLessEqual(mapped.call_count, 1 + 2)
+
+
 """
 Test class for the convertDate method
 """
@@ -125,5 +1003,33 @@ class TestDateMethod(unittest.TestCase):
         self.assertSequenceEqual(result_set, answers)
 
 
+"""
+Test class for the cached date normalization
+"""
+
+
+class TestDateCache(unittest.TestCase):
+    def test_normalize_date(self):
+        normalize_date.cache_clear()
+        values = ['Jun-17', '21-01-1917', '1917-01-21', '', None] * 3
+        self.assertListEqual([normalize_date(value) for value in values],
+                             ['1917-06', '1917-01-21', '1917-01-21', 'n.d.', 'n.d.'] * 3)
+        info = normalize_date.cache_info()
+        self.assertEqual(info.misses, 5)
+        self.assertEqual(info.hits, 10)
+
+    def test_shared_per_document(self):
+        filename = 'test/input/klhs_photographs/klhs_1.xml'
+        with open(filename, 'r', encoding='utf8') as infile:
+            soup = load_soup(infile.read(), 0, filename)
+        with mock.patch('mappings.indexed', wraps=indexed) as spy:
+            mappings['Title'](soup)
+            mappings['DateCreated'](soup)
+        date_lookups = [c for c in spy.call_args_list
+                        if c.args[1:3] == ('dateIssued', {'encoding': 'w3cdtf', 'keyDate': 'yes'})]
+        self.assertEqual(len(date_lookups), 1)
+        self.assertEqual(soup.stores['DateCreated']['DateCreated'], mappings['DateCreated'](soup))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,13 +5,13 @@
 # Created by: PyQt5 UI code generator 5.13.1
 #
 # WARNING! All changes made in this file will be lost!
-import glob
 import os
+import time
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
 
-from logic import convert_to_csv, get_mods_files
+from logic import Cancelled, convert_to_csv, iter_mods_files
 
 
 def get_version():
@@ -26,6 +26,54 @@ def show_msg(msg, msg_type):
     msg_box.exec()
 
 
+def format_duration(seconds):
+    """
+    Formats seconds as h:mm:ss for the status bar
+    :param seconds: the number of seconds
+    :return: the formatted str
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class ConvertThread(QtCore.QThread):
+    """
+    Runs convert_to_csv off the main thread so the window stays responsive
+    """
+    progressed = QtCore.pyqtSignal(int, int, str)  # done, total, filename
+    succeeded = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, input_folder, output_folder, output_file, files=None, parent=None):
+        super().__init__(parent)
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.output_file = output_file
+        self.files = files
+
+    def report(self, done, total, filename):
+        """
+        Progress callback for convert_to_csv, stops the conversion once Cancel was clicked
+        :return: None
+        """
+        if self.isInterruptionRequested():
+            raise Cancelled()
+        self.progressed.emit(done, total, filename)
+
+    def run(self):
+        try:
+            convert_to_csv(self.input_folder, self.output_folder, self.output_file, progress=self.report,
+                           files=self.files)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.succeeded.emit()
+
+
 class Ui_MainWindow(object):
     # Big UI stuff, ignore and scroll to bottom
     def setupUi(self, MainWindow):
@@ -46,7 +94,7 @@ class Ui_MainWindow(object):
         self.lblName.setScaledContents(False)
         self.lblName.setObjectName("lblName")
         self.fileListWidget = QtWidgets.QListWidget(self.centralwidget)
-        self.fileListWidget.setGeometry(QtCore.QRect(10, 290, 441, 231))
+        self.fileListWidget.setGeometry(QtCore.QRect(10, 290, 441, 201))
         self.fileListWidget.setStyleSheet("background-color: rgb(239, 239, 239);\n"
                                           "font: 11pt \"Gadugi\";\n"
                                           "color: rgb(0, 125, 92);")
@@ -66,14 +114,28 @@ class Ui_MainWindow(object):
                                           "border-radius: 5px;\n"
                                           "font: 11pt \"Gadugi\";")
         self.btnBrowseInput.setObjectName("btnBrowseInput")
+        self.progressBar = QtWidgets.QProgressBar(self.centralwidget)
+        self.progressBar.setGeometry(QtCore.QRect(10, 500, 441, 21))
+        self.progressBar.setStyleSheet("font: 9pt \"Gadugi\";")
+        self.progressBar.setValue(0)
+        self.progressBar.setObjectName("progressBar")
         self.btnStart = QtWidgets.QPushButton(self.centralwidget)
-        self.btnStart.setGeometry(QtCore.QRect(10, 530, 441, 41))
+        self.btnStart.setGeometry(QtCore.QRect(10, 530, 351, 41))
         self.btnStart.clicked.connect(self.btn_start)
         self.btnStart.setStyleSheet("background-color: rgb(0, 170, 127);\n"
                                     "color: rgb(255, 255, 255);\n"
                                     "border-radius: 5px;\n"
                                     "font: 11pt \"Gadugi\";")
         self.btnStart.setObjectName("btnStart")
+        self.btnCancel = QtWidgets.QPushButton(self.centralwidget)
+        self.btnCancel.setGeometry(QtCore.QRect(370, 530, 81, 41))
+        self.btnCancel.clicked.connect(self.btn_cancel)
+        self.btnCancel.setStyleSheet("background-color: rgb(170, 0, 43);\n"
+                                     "color: rgb(255, 255, 255);\n"
+                                     "border-radius: 5px;\n"
+                                     "font: 11pt \"Gadugi\";")
+        self.btnCancel.setEnabled(False)
+        self.btnCancel.setObjectName("btnCancel")
         self.btnBrowseOutput = QtWidgets.QPushButton(self.centralwidget)
         self.btnBrowseOutput.setGeometry(QtCore.QRect(370, 210, 81, 31))
         self.btnBrowseOutput.clicked.connect(self.btn_output_folder_select)
@@ -114,6 +176,8 @@ class Ui_MainWindow(object):
         self.retranslateUi(MainWindow)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
+        self.listing = None  # (input folder, sorted files) shown in the list, reused by the conversion
+
     def retranslateUi(self, MainWindow):
         _translate = QtCore.QCoreApplication.translate
         MainWindow.setWindowTitle(_translate("MainWindow", "Arca - XMLtoCSV 0.1.0"))
@@ -122,6 +186,7 @@ class Ui_MainWindow(object):
         self.txtInputPath.setPlaceholderText(_translate("MainWindow", "Select an input folder..."))
         self.btnBrowseInput.setText(_translate("MainWindow", "Browse..."))
         self.btnStart.setText(_translate("MainWindow", "Convert"))
+        self.btnCancel.setText(_translate("MainWindow", "Cancel"))
         self.btnBrowseOutput.setText(_translate("MainWindow", "Browse..."))
         self.txtOutputPath.setPlaceholderText(_translate("MainWindow", "Select an output folder..."))
         self.txtOutputFile.setPlaceholderText(_translate("MainWindow", "Enter the output file name..."))
@@ -155,13 +220,34 @@ class Ui_MainWindow(object):
             output_file = selected_folder.replace("\\", os.sep).replace("/", os.sep)
             output_file = output_file.split(os.sep)[-1]
             self.txtOutputFile.setText(output_file + ".csv")
-            # Clear list widget
-            self.fileListWidget.clear()
-            # Fill list widget
-            self.fileListWidget.addItems(
-                [filename.replace('/', os.sep).replace('\\', os.sep) for filename in
-                 get_mods_files(selected_folder)]
-            )
+            self.list_files(selected_folder)
+
+    def list_files(self, folder):
+        """
+        Fills the list widget with the MODS XML files of a folder, showing them as they are found.
+        The sorted listing is kept for the conversion so the folder isn't walked twice
+        :param folder: the input folder
+        :return: None
+        """
+        self.fileListWidget.clear()
+        files = []
+        for filename in iter_mods_files(folder):
+            files.append(filename)
+            if len(files) % 1000 == 0:
+                self.fileListWidget.addItems([self.display_name(f) for f in files[-1000:]])
+                self.statusbar.showMessage('Found %d files...' % len(files))
+                QtWidgets.QApplication.processEvents()
+
+        # Show them in conversion order, see conversion_progressed
+        files.sort()
+        self.fileListWidget.clear()
+        self.fileListWidget.addItems([self.display_name(f) for f in files])
+        self.statusbar.showMessage('Found %d files' % len(files))
+        self.listing = (folder, files)
+
+    @staticmethod
+    def display_name(filename):
+        return filename.replace('/', os.sep).replace('\\', os.sep)
 
     def btn_output_folder_select(self):
         """
@@ -187,16 +273,80 @@ class Ui_MainWindow(object):
             output_file = self.txtOutputFile.toPlainText()
             if not output_file.endswith('.csv'):
                 output_file = output_file + '.csv'
-            convert_to_csv(
-                self.txtInputPath.toPlainText(),
+            input_folder = self.txtInputPath.toPlainText()
+            files = self.listing[1] if self.listing is not None and self.listing[0] == input_folder else None
+            self.thread = ConvertThread(
+                input_folder,
                 self.txtOutputPath.toPlainText(),
-                output_file
-            )
-            show_msg(
-                'Converted files and placed in ' + self.txtOutputPath.toPlainText() +
-                "/" + self.txtOutputFile.toPlainText(),
-                QMessageBox.Information
+                output_file,
+                files
             )
+            self.thread.progressed.connect(self.conversion_progressed)
+            self.thread.succeeded.connect(self.conversion_succeeded)
+            self.thread.failed.connect(self.conversion_failed)
+            self.thread.cancelled.connect(self.conversion_cancelled)
+            self.thread.finished.connect(self.conversion_finished)
+            self.set_running(True)
+            self.progressBar.setValue(0)
+            self.statusbar.showMessage('Starting conversion...')
+            self.started_at = time.perf_counter()
+            self.thread.start()
+
+    def btn_cancel(self):
+        """
+        Executed when the Cancel button is clicked.
+        Asks the conversion thread to stop, it stops after the file it is on
+        :return: None
+        """
+        self.btnCancel.setEnabled(False)
+        self.statusbar.showMessage('Cancelling...')
+        self.thread.requestInterruption()
+
+    def set_running(self, running):
+        """
+        Enables or disables the controls while a conversion runs
+        :param running: whether a conversion is running
+        :return: None
+        """
+        for widget in [self.btnStart, self.btnBrowseInput, self.btnBrowseOutput, self.txtOutputFile]:
+            widget.setEnabled(not running)
+        self.btnCancel.setEnabled(running)
+
+    def conversion_progressed(self, done, total, filename):
+        """
+        Updates the progress bar, file list and status bar after each file
+        :param done: the number of files converted
+        :param total: the total number of files
+        :param filename: the file just converted
+        :return: None
+        """
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        if done - 1 < self.fileListWidget.count():
+            self.fileListWidget.setCurrentRow(done - 1)
+
+        elapsed = time.perf_counter() - self.started_at
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (total - done) / rate if rate > 0 else 0
+        self.statusbar.showMessage('%d/%d files, %.1f files/sec, ETA %s' % (done, total, rate, format_duration(eta)))
+
+    def conversion_succeeded(self):
+        self.statusbar.showMessage('Converted in %s' % format_duration(time.perf_counter() - self.started_at))
+        show_msg(
+            'Converted files and placed in ' + self.txtOutputPath.toPlainText() +
+            "/" + self.txtOutputFile.toPlainText(),
+            QMessageBox.Information
+        )
+
+    def conversion_failed(self, error):
+        self.statusbar.showMessage('Conversion failed')
+        show_msg('Conversion failed: ' + error, QMessageBox.Critical)
+
+    def conversion_cancelled(self):
+        self.statusbar.showMessage('Conversion cancelled')
+
+    def conversion_finished(self):
+        self.set_running(False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,299 @@
+"""
+Output writers for converted rows.
+
+CSV files are written in the same format as DataFrame.to_csv, optionally compressed
+on the fly and split into numbered parts. Parquet and Arrow IPC (Feather) files are
+written with pyarrow, which is only needed for those formats, and SQLite databases
+with sqlite3, all in batches of BATCH_ROWS rows so a collection never has to fit
+in memory. The key is an integer column and every other column a string column,
+cells without a value are nulls.
+"""
+import abc
+import csv
+import gzip
+import io
+import os
+import re
+import sqlite3
+
+BATCH_ROWS = 10000  # Rows per Parquet row group / Arrow record batch / SQLite transaction
+COMPRESSION = 'zstd'  # Compression of Parquet and Feather files
+TABLE = 'records'  # The SQLite table the rows go in
+INDEXED = ['PID', 'LocalIdentifier', 'DateCreated']  # SQLite columns looked up after conversions
+
+
+# CSV compression -> file extension
+compressions = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def open_text(path, compression=None):
+    """
+    Opens a text file to write CSV to
+    :param path: the file path
+    :param compression: 'gzip' or 'zstd' to compress on the fly, None for none
+    :return: the text file object
+    """
+    if compression is None:
+        return open(path, 'w', encoding='utf-8', newline='')
+    if compression == 'gzip':
+        # No timestamp in the header, so re-runs write identical files
+        return io.TextIOWrapper(gzip.GzipFile(path, 'wb', mtime=0), encoding='utf-8', newline='')
+    try:
+        from compression import zstd  # Python 3.14+
+    except ImportError:
+        try:
+            import zstandard as zstd
+        except ImportError:
+            raise ImportError('zstd compression needs Python 3.14 or zstandard, install it with pip install zstandard')
+    return zstd.open(path, 'wt', encoding='utf-8', newline='')
+
+
+class CsvWriter(object):
+    """
+    Writes rows to a CSV file. With part_rows or part_bytes the rows are split over numbered
+    parts (see part_path), each starting with the header. A part is closed before the row that
+    would take it past either limit, sizes count the uncompressed bytes so the parts come out
+    the same on every run
+    """
+
+    def __init__(self, path, cols, flush_every=1000, compression=None, part_rows=None, part_bytes=None):
+        suffix = compressions[compression] if compression is not None else ''
+        self.path = path if path.endswith(suffix) else path + suffix
+        self.stem, self.ext = os.path.splitext(self.path[:len(self.path) - len(suffix)])
+        self.ext += suffix
+        self.cols = cols
+        self.flush_every = flush_every
+        self.compression = compression
+        self.part_rows = part_rows
+        self.part_bytes = part_bytes
+        self.split = part_rows is not None or part_bytes is not None
+        self.paths = []  # The files written
+        self.count = 0
+
+        # Rows are formatted here first when their size is needed
+        self.line = io.StringIO()
+        self.line_writer = csv.DictWriter(self.line, fieldnames=cols, lineterminator=os.linesep)
+        self.line_writer.writeheader()
+        self.header = self.line.getvalue()
+
+        self.outfile = None
+        self.open_part()
+
+    def part_path(self, n):
+        """
+        Gets the path of a part
+        :param n: the part number, from 1
+        :return: the path e.g. out/collection_part0001.csv.gz for out/collection.csv with gzip
+        """
+        return '%s_part%04d%s' % (self.stem, n, self.ext)
+
+    def open_part(self):
+        if self.outfile is not None:
+            self.outfile.close()
+        path = self.part_path(len(self.paths) + 1) if self.split else self.path
+        self.paths.append(path)
+        self.outfile = open_text(path, self.compression)
+        self.outfile.write(self.header)
+        self.writer = csv.DictWriter(self.outfile, fieldnames=self.cols, lineterminator=os.linesep)
+        self.part_count = 0
+        self.part_size = len(self.header.encode('utf-8'))
+
+    def write(self, row):
+        if self.part_bytes is not None:
+            self.line.seek(0)
+            self.line.truncate()
+            self.line_writer.writerow(row)
+            line = self.line.getvalue()
+            size = len(line.encode('utf-8'))
+        else:
+            line, size = None, 0
+
+        if self.part_count and (self.part_rows is not None and self.part_count >= self.part_rows or
+                                self.part_bytes is not None and self.part_size + size > self.part_bytes):
+            self.open_part()
+
+        if line is None:
+            self.writer.writerow(row)
+        else:
+            self.outfile.write(line)
+        self.part_count += 1
+        self.part_size += size
+        self.count += 1
+        # Flushing a compressed file would hurt its compression
+        if self.compression is None and self.count % self.flush_every == 0:
+            self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+        if self.split:
+            self.remove_stale_parts()
+
+    def remove_stale_parts(self):
+        """
+        Removes parts left over from an earlier run that wrote more parts
+        :return: None
+        """
+        folder = os.path.dirname(self.path) or '.'
+        pattern = re.compile(re.escape(os.path.basename(self.stem) + '_part') + r'\d{4,}' + re.escape(self.ext) + '$')
+        written = {os.path.basename(path) for path in self.paths}
+        for name in os.listdir(folder):
+            if pattern.match(name) and name not in written:
+                os.remove(os.path.join(folder, name))
+
+
+class ArrowWriter(abc.ABC):
+    """
+    Collects rows into column batches, the subclasses open the pyarrow writer the batches go to
+    """
+
+    def __init__(self, path, cols):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('pyarrow is needed for the %s format, install it with pip install pyarrow' %
+                              type(self).format)
+        self.pa = pyarrow
+        self.path = path
+        self.cols = cols
+        self.schema = pyarrow.schema([(col, pyarrow.int64() if col == 'key' else pyarrow.string()) for col in cols])
+        self.columns = {col: [] for col in cols}
+        self.count = 0
+        self.pending = 0  # Rows not written yet
+        self.writer = self.open(path)
+
+    @abc.abstractmethod
+    def open(self, path):
+        """
+        Opens the pyarrow writer
+        :param path: the output path
+        :return: the writer, with write_batch and close
+        """
+
+    def write(self, row):
+        for col in self.cols:
+            value = row.get(col)
+            self.columns[col].append(int(value) if col == 'key' and value is not None else value)
+        self.count += 1
+        self.pending += 1
+        if self.pending == BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.writer.write_batch(self.pa.RecordBatch.from_pydict(self.columns, schema=self.schema))
+            self.columns = {col: [] for col in self.cols}
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ParquetWriter(ArrowWriter):
+    format = 'parquet'
+
+    def open(self, path):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(path, self.schema, compression=COMPRESSION)
+
+
+class FeatherWriter(ArrowWriter):
+    format = 'feather'
+
+    def open(self, path):
+        import pyarrow.ipc
+        self.sink = self.pa.OSFile(path, 'wb')
+        options = pyarrow.ipc.IpcWriteOptions(compression=COMPRESSION)
+        return pyarrow.ipc.new_file(self.sink, self.schema, options=options)
+
+    def close(self):
+        super().close()
+        self.sink.close()
+
+
+class SqliteWriter(object):
+    """
+    Writes rows to the records table of a SQLite database, replacing the table if it exists.
+    Rows are inserted BATCH_ROWS at a time, one transaction each, and the INDEXED columns
+    are indexed once every row is in
+    """
+
+    def __init__(self, path, cols):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.cols = cols
+        self.conn.execute('DROP TABLE IF EXISTS %s' % TABLE)
+        self.conn.execute('CREATE TABLE %s (%s)' % (TABLE, ', '.join(
+            '"%s" %s' % (col, 'INTEGER PRIMARY KEY' if col == 'key' else 'TEXT') for col in cols)))
+        self.insert = 'INSERT INTO %s VALUES (%s)' % (TABLE, ', '.join('?' * len(cols)))
+        self.batch = []
+        self.count = 0
+
+    def write(self, row):
+        self.batch.append(tuple(int(row[col]) if col == 'key' and row.get(col) is not None else row.get(col)
+                                for col in self.cols))
+        self.count += 1
+        if len(self.batch) == BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        with self.conn:
+            self.conn.executemany(self.insert, self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        with self.conn:
+            for col in INDEXED:
+                if col in self.cols:
+                    self.conn.execute('CREATE INDEX "%s_%s" ON %s ("%s")' % (TABLE, col, TABLE, col))
+        self.conn.close()
+
+
+# Output format -> (writer class, file extension)
+formats = {
+    'csv': (CsvWriter, '.csv'),
+    'parquet': (ParquetWriter, '.parquet'),
+    'feather': (FeatherWriter, '.feather'),
+    'sqlite': (SqliteWriter, '.sqlite')
+}
+
+
+def open_writer(path, cols, output_format='csv', compression=None, part_rows=None, part_bytes=None):
+    """
+    Opens a writer for rows, call write(row) for each row and close() at the end.
+    The writer's path is the file written, e.g. with .gz added, and a split CSV writer's paths its parts
+    :param path: the output path
+    :param cols: the column names, in output order
+    :param output_format: the output format, see formats
+    :param compression: for CSV, 'gzip' or 'zstd' to compress the file (adding .gz or .zst to its name)
+    :param part_rows: for CSV, the most rows per part, None to not split by rows
+    :param part_bytes: for CSV, the most (uncompressed) bytes per part, None to not split by size
+    :return: the writer
+    """
+    if output_format == 'csv':
+        return CsvWriter(path, cols, compression=compression, part_rows=part_rows, part_bytes=part_bytes)
+    if compression is not None or part_rows is not None or part_bytes is not None:
+        raise ValueError('compression and parts are only for csv output, %s files are compressed already' %
+                         output_format)
+    return formats[output_format][0](path, cols)
+
+
+def write_rows(rows, cols, path, **options):
+    """
+    Writes rows to a file as they come in
+    :param rows: iterable of row dicts
+    :param cols: the column names, in output order
+    :param path: the output path
+    :param options: the output_format, compression, part_rows and part_bytes, see open_writer
+    :return: the number of rows written
+    """
+    writer = open_writer(path, cols, **options)
+    try:
+        for row in rows:
+            writer.write(row)
+    finally:
+        writer.close()
+    return writer.count
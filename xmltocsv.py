@@ -0,0 +1,216 @@
+"""
+Command line entry point, converts one or more collection folders to CSV files.
+
+Usage:
+    python -m xmltocsv INPUT [INPUT ...] -o OUTPUT_FOLDER [options]
+
+INPUT can be a collection folder or a glob of collection folders (e.g. 'exports/*'),
+each collection is converted to OUTPUT_FOLDER/<collection name>.csv (or .parquet/.feather/.sqlite, see --format).
+Collections are named after their folder, or their path for folders with the same name (a/klhs -> a_klhs).
+With --errors, files that fail are skipped and listed in OUTPUT_FOLDER/<collection name>.errors.csv (or .jsonl)
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from errors import read_report
+from logic import convert_to_csv, engines, get_mods_files
+from writers import compressions, formats
+
+
+def collection_folders(patterns):
+    """
+    Expands the input folders and globs into collection folders
+    :param patterns: list of folders or glob patterns
+    :return: list of folders, in the order given and without duplicates
+    """
+    folders = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for folder in matches:
+            folder = os.path.normpath(folder)
+            if os.path.isdir(folder) and folder not in folders:
+                folders.append(folder)
+    return folders
+
+
+def collection_names(folders):
+    """
+    Names the collections, which names their output files. A collection is named after its folder,
+    folders with the same name are named after their path below the folders' common parent instead
+    e.g. a/klhs and b/klhs become a_klhs and b_klhs
+    :param folders: the collection folders
+    :return: list of the names, in the order of folders. Names can still clash (e.g. for a_b/klhs and a/b_klhs)
+    """
+    paths = [os.path.abspath(folder) for folder in folders]
+    names = [os.path.basename(path) for path in paths]
+    clashing = [path for path, name in zip(paths, names) if names.count(name) > 1]
+    if clashing:
+        parent = os.path.commonpath(clashing)
+        names = [os.path.relpath(path, parent).replace(os.sep, '_') if path in clashing else name
+                 for path, name in zip(paths, names)]
+    return names
+
+
+def output_name(name, output_format='csv'):
+    """
+    Gets the output file name for a collection
+    :param name: the collection name, see collection_names
+    :param output_format: the output format, see writers.formats
+    :return: the file name e.g. klhs_photographs.csv
+    """
+    return name + formats[output_format][1]
+
+
+def convert_collection(input_folder, output_folder, options, discovery=None, errors=None, quarantine=None,
+                       name=None):
+    """
+    Converts one collection, catching any error so the other collections carry on
+    :param input_folder: the collection folder
+    :param output_folder: the output folder
+    :param options: dict of keyword arguments for convert_to_csv
+    :param discovery: dict of keyword arguments for get_mods_files, None for the defaults
+    :param errors: 'csv' or 'jsonl' to convert fail-soft, writing the failed files to <collection name>.errors.<errors>
+    in the output folder. None to fail the collection at the first error
+    :param quarantine: the folder to copy failed files to, in a <collection name> folder
+    :param name: the collection name (see collection_names), None for the folder name
+    :return: tuple of the input folder, seconds taken, the error message (None on success) and the error report
+    path and the number of failed files (None when not fail-soft)
+    """
+    start = time.perf_counter()
+    report = None
+    if name is None:
+        name = os.path.basename(os.path.abspath(input_folder))
+    try:
+        files = get_mods_files(input_folder, **(discovery or {}))
+        output_file = output_name(name, options.get('output_format', 'csv'))
+        fail_soft = {}
+        if errors is not None:
+            fail_soft['errors'] = os.path.join(output_folder, '%s.errors.%s' % (name, errors))
+            if quarantine is not None:
+                fail_soft['quarantine'] = os.path.join(quarantine, name)
+        convert_to_csv(input_folder, output_folder, output_file, files=files, **options, **fail_soft)
+        if errors is not None:
+            report = fail_soft['errors'], len(read_report(fail_soft['errors']))
+        error = None
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    return input_folder, time.perf_counter() - start, error, report
+
+
+def parse_size(size):
+    """
+    Parses a size for --part-bytes
+    :param size: the size in bytes, optionally with a K, M or G suffix e.g. 500M
+    :return: the number of bytes
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    size = size.strip().upper().rstrip('B')
+    try:
+        if size[-1:] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size %r, expected e.g. 1000000, 500K, 500M or 2G' % size)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='xmltocsv', description='Converts folders of MODS XML files to CSV files')
+    parser.add_argument('inputs', nargs='+', help='collection folders or globs of collection folders')
+    parser.add_argument('-o', '--output', required=True, help='the folder to write the CSV files to')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of collections to convert at once')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes per collection')
+    parser.add_argument('--engine', choices=sorted(engines), default='soup', help='the extraction engine')
+    parser.add_argument('--streaming', action='store_true', help='write rows as soon as they are mapped')
+    parser.add_argument('--format', choices=list(formats), default='csv',
+                        help='the output format, parquet and feather need pyarrow')
+    parser.add_argument('--compression', choices=list(compressions), help='compress CSV output as it is written')
+    parser.add_argument('--part-rows', type=int, metavar='N', help='split CSV output into parts of N rows')
+    parser.add_argument('--part-bytes', type=parse_size, metavar='SIZE',
+                        help='split CSV output into parts of SIZE uncompressed bytes e.g. 500M')
+    parser.add_argument('--split-profiles', action='store_true', help='write one CSV per profile for mixed folders')
+    parser.add_argument('--incremental', action='store_true', help='only parse new or changed files')
+    parser.add_argument('--resume', action='store_true',
+                        help='keep a checkpoint while converting and carry on from it if a conversion was stopped')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                        help='file name pattern of the MODS files, can be repeated (default: *.xml)')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='file or folder name, or relative path, pattern to skip, can be repeated')
+    parser.add_argument('--max-depth', type=int, help='how many folders down to look in each collection')
+    parser.add_argument('--errors', choices=['csv', 'jsonl'],
+                        help='skip files that fail and list them in <collection name>.errors.csv (or .jsonl)')
+    parser.add_argument('--quarantine', metavar='FOLDER', help='copy the files that fail to FOLDER, needs --errors')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the command line
+    :param argv: the arguments, None for sys.argv
+    :return: the exit code, 0 if every collection converted
+    """
+    args = parse_args(argv)
+    if args.quarantine is not None and args.errors is None:
+        print('--quarantine needs --errors', file=sys.stderr)
+        return 2
+    folders = collection_folders(args.inputs)
+    if not folders:
+        print('No collection folders found', file=sys.stderr)
+        return 2
+    names = collection_names(folders)
+    clashes = sorted({name for name in names if names.count(name) > 1})
+    if clashes:
+        print('Collections would be written to the same files: %s' % ', '.join(clashes), file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+    options = {
+        'engine': args.engine,
+        'streaming': args.streaming,
+        'workers': args.workers,
+        'split_profiles': args.split_profiles,
+        'incremental': args.incremental,
+        'resume': args.resume,
+        'output_format': args.format,
+        'compression': args.compression,
+        'part_rows': args.part_rows,
+        'part_bytes': args.part_bytes
+    }
+    discovery = {'include': args.include or ['*.xml'], 'exclude': args.exclude, 'max_depth': args.max_depth}
+    fail_soft = (args.errors, args.quarantine)
+
+    start = time.perf_counter()
+    failures = 0
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        futures = [executor.submit(convert_collection, folder, args.output, options, discovery, *fail_soft, name)
+                   for folder, name in zip(folders, names)]
+        results = (future.result() for future in futures)
+    else:
+        executor = None
+        results = (convert_collection(folder, args.output, options, discovery, *fail_soft, name)
+                   for folder, name in zip(folders, names))
+
+    try:
+        for folder, seconds, error, report in results:
+            if error is None:
+                print('Converted %s in %.2fs' % (folder, seconds))
+                if report is not None and report[1]:
+                    print('%d files of %s failed, see %s' % (report[1], folder, report[0]), file=sys.stderr)
+            else:
+                failures += 1
+                print('FAILED %s after %.2fs: %s' % (folder, seconds, error), file=sys.stderr)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print('%d of %d collections converted in %.2fs' % (len(folders) - failures, len(folders),
+                                                        time.perf_counter() - start))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())